@@ -4,8 +4,14 @@ Frame = namedtuple('Frame', ['start', 'end', 'name'])
 NodePosition = namedtuple('NodePosition', ['start', 'end'])
 
 class Context(object):
-    def __init__(self, sentence, parse_tree, frame, node_pos):
+    """
+    span_index: the `tree_util.SpanIndex` of `parse_tree`, optional
+    memo: dict shared by the contexts of the same sentence, where features keep values computed in batch, optional
+    """
+    def __init__(self, sentence, parse_tree, frame, node_pos, span_index = None, memo = None):
         self.sentence =  sentence
         self.parse_tree = parse_tree
         self.frame = frame
         self.node_pos = node_pos
+        self.span_index = span_index
+        self.memo = memo
@@ -0,0 +1,100 @@
+"""
+Pruning of the argument candidates before feature extraction
+
+Most tree nodes far from the frame target can never be frame elements,
+a pruner keeps the likely ones and counts how many of the gold frame elements it keeps.
+"""
+
+
+class XuePalmerPruner(object):
+    """
+    The heuristic of Xue & Palmer(2004, Calibrating features for semantic role labeling):
+    starting from the target node, the siblings of it and of each of its ancestors are candidates,
+    and if a sibling is a PP, its children as well.
+
+    Counters over all the `prune` calls:
+    - n_nodes, n_kept: nodes before and after pruning
+    - n_roles, n_roles_kept: gold frame element nodes before and after pruning
+
+    >>> from nltk.tree import Tree
+    >>> from tree_util import SpanIndex
+    >>> tree = Tree.fromstring('(ROOT (S (NP (PRP I)) (VP (VBD went) (PP (TO to) (NP (NN school))) (NP (NN today)))))')
+    >>> index = SpanIndex(tree)
+    >>> pruner = XuePalmerPruner()
+    >>> frame_node = tree[0][1][0] # went
+    >>> roles = {id(tree[0][0]): 'Self_mover', id(tree[0][1][1][1]): 'Goal', id(tree[0][1][1][1][0]): 'Nothing'}
+    >>> [' '.join(node.leaves()) for node, _ in pruner.prune(index.nodes, frame_node, index, roles)]
+    ['I', 'to', 'school', 'to school', 'today']
+    >>> pruner.n_nodes, pruner.n_kept, pruner.n_roles, pruner.n_roles_kept
+    (11, 5, 3, 2)
+    >>> print pruner.report()
+    Pruning: 5 of 11 candidates kept(45.45%), recall of the frame elements 66.67%
+    """
+    def __init__(self):
+        self.n_nodes = 0
+        self.n_kept = 0
+        self.n_roles = 0
+        self.n_roles_kept = 0
+
+    def candidates(self, frame_node, index):
+        """
+        The ids of the candidate nodes of the target `frame_node`
+
+        index: `tree_util.SpanIndex` of the tree
+        """
+        candidates = set()
+        node = frame_node
+        while id(node) in index.parents:
+            parent = index.parents[id(node)]
+            for sibling in parent:
+                if sibling is node or isinstance(sibling, basestring):
+                    continue
+                candidates.add(id(sibling))
+                if sibling.label() == 'PP':
+                    candidates.update(id(child) for child in sibling if not isinstance(child, basestring))
+            node = parent
+        return candidates
+
+    def prune(self, nodes, frame_node, index, roles = None):
+        """
+        The (node, span) in `nodes` that are candidates, in the same order
+
+        roles: gold roles of the nodes(see `data.gold_roles`), for counting the recall
+        """
+        candidates = self.candidates(frame_node, index)
+        kept = [(node, span) for node, span in nodes if id(node) in candidates]
+
+        self.n_nodes += len(nodes)
+        self.n_kept += len(kept)
+        if roles is not None:
+            self.n_roles += len(roles)
+            self.n_roles_kept += sum(1 for node_id in roles if node_id in candidates)
+        return kept
+
+    @property
+    def recall(self):
+        return float(self.n_roles_kept) / self.n_roles if self.n_roles > 0 else 1.
+
+    @property
+    def kept_rate(self):
+        return float(self.n_kept) / self.n_nodes if self.n_nodes > 0 else 1.
+
+    def counts(self):
+        return (self.n_nodes, self.n_kept, self.n_roles, self.n_roles_kept)
+
+    def add_counts(self, counts):
+        """
+        Add the `counts` of another pruner, e.g. one in a worker process
+        """
+        n_nodes, n_kept, n_roles, n_roles_kept = counts
+        self.n_nodes += n_nodes
+        self.n_kept += n_kept
+        self.n_roles += n_roles
+        self.n_roles_kept += n_roles_kept
+
+    def reset(self):
+        self.n_nodes = self.n_kept = self.n_roles = self.n_roles_kept = 0
+
+    def report(self):
+        return "Pruning: %d of %d candidates kept(%.2f%%), recall of the frame elements %.2f%%" \
+            %(self.n_kept, self.n_nodes, 100 * self.kept_rate, 100 * self.recall)
@@ -1,29 +1,77 @@
 import sys
-
-from nltk.parse.stanford import StanfordParser
+import os
+from multiprocessing import Pool
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from features import FeatureExtractionFail
 from basic_struct import Context, Frame, NodePosition
 from feature_extractor import FeatureExtractor
-from tree_util import (collect_nodes, find_node_by_positions)
+from tree_util import (SpanIndex, collect_nodes, find_node_by_positions)
 from ling_util import convert_brackets
-from annotation import align_annotation_with_sentence
-        
-parser=StanfordParser(
-    path_to_jar = "/cs/fs/home/hxiao/code/stanford-parser-full-2015-01-30/stanford-parser.jar",
-    path_to_models_jar = "/cs/fs/home/hxiao/code/stanford-parser-full-2015-01-30/stanford-parser-3.5.1-models.jar",
-    model_path="edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz"
-)
+from annotation import (parse_fulltext, align_annotation_with_sentence)
+from parser_backend import StanfordParserBackend
+from labels import (NULL_LABEL, LabelIndex, subsample_null, check_null_rate)
+
+PARSER_JAR = "/cs/fs/home/hxiao/code/stanford-parser-full-2015-01-30/stanford-parser.jar"
+PARSER_MODELS_JAR = "/cs/fs/home/hxiao/code/stanford-parser-full-2015-01-30/stanford-parser-3.5.1-models.jar"
+PARSER_MODEL_PATH = "edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz"
+
+_default_parser = None
+
+def get_parser():
+    """
+    The default parser backend, created on first use
+    """
+    global _default_parser
+    if _default_parser is None:
+        _default_parser = StanfordParserBackend(PARSER_JAR, PARSER_MODELS_JAR, PARSER_MODEL_PATH)
+    return _default_parser
+
+def parse_sentences(sents, parser = None, parse_cache = None):
+    """
+    Parse `sents` by the `parser` backend(default to `get_parser()`) in one batch
+
+    The `parse_cache`(see `parse_cache.ParseCache`) is consulted first if given and only the missing sentences are parsed
 
-def make_training_data(feature_funcs, annotations):
+    >>> from parser_backend import PreparsedBackend
+    >>> trees = parse_sentences([u'Your contribution to Goodwill will mean more than you may know .'], PreparsedBackend('test_data/parses.tsv'))
+    >>> trees[0].leaves()[:2]
+    [u'Your', u'contribution']
+    """
+    if parser is None:
+        parser = get_parser()
+
+    trees = [None] * len(sents)
+    if parse_cache is not None:
+        trees = [parse_cache.get(sent) for sent in sents]
+
+    missing = [i for i, tree in enumerate(trees) if tree is None]
+    if len(missing) > 0:
+        parsed = parser.parse_sents([sents[i] for i in missing])
+        for i, tree in zip(missing, parsed):
+            trees[i] = tree
+            if parse_cache is not None:
+                parse_cache.put(sents[i], tree)
+    return trees
+
+def make_training_data(feature_funcs, annotations, parse_cache = None, parser = None, pruner = None):
     """
     Given the FrameNet annotations, return the training instances in terms of the tree nodes
 
+    The sentences are parsed in one batch by `parser`(see `parse_sentences`).
+    If `parse_cache` is given, sentences parsed before are loaded from it instead of being parsed again.
+    If `pruner` is given(see `candidate_pruning`), only the candidate nodes it keeps become instances
+
     >>> from annotation import parse_fulltext
+    >>> from parser_backend import PreparsedBackend
+    >>> parser = PreparsedBackend("test_data/parses.tsv")
     >>> annotations = parse_fulltext("test_data/annotation.xml")
     >>> from features import DummyNodeFeature
-    >>> instances = make_training_data([DummyNodeFeature], annotations)
-    >>> len(instances) # 27 nodes times 2 annotations
+    >>> instances = make_training_data([DummyNodeFeature], annotations, parser = parser)
+    >>> len(instances) # 26 nodes times 2 annotations
     52
     >>> [i for i in instances if i[1] == 'Recipient'][0][0]
     {'node_dummy': ([u'to', u'Goodwill'], u'PP')}
@@ -36,68 +84,243 @@ def make_training_data(feature_funcs, annotations):
 
     >>> from features import PathToFrame
     >>> annotations = parse_fulltext("test_data/annotation3.xml")
-    >>> instances = make_training_data([PathToFrame], annotations)
+    >>> instances = make_training_data([PathToFrame], annotations, parser = parser)
+
+    >>> from candidate_pruning import XuePalmerPruner
+    >>> pruner = XuePalmerPruner()
+    >>> instances = make_training_data([DummyNodeFeature], parse_fulltext("test_data/annotation.xml"), parser = parser, pruner = pruner)
+    >>> len(instances), pruner.n_nodes, pruner.recall
+    (10, 52, 1.0)
+    >>> sorted(role for _, role in instances if role != 'NULL')
+    ['Donor', 'Means', 'Recipient', 'Value']
+    """
+    return list(iter_training_data(feature_funcs, annotations, parse_cache, parser, pruner))
+
+def iter_training_data(feature_funcs, annotations, parse_cache = None, parser = None, pruner = None):
+    """
+    Generator version of `make_training_data`, yielding one (feature_values, role) instance at a time
+
+    >>> from annotation import parse_fulltext
+    >>> from parser_backend import PreparsedBackend
+    >>> from features import DummyNodeFeature
+    >>> instances = iter_training_data([DummyNodeFeature], parse_fulltext("test_data/annotation.xml"), parser = PreparsedBackend("test_data/parses.tsv"))
+    >>> instances.next()
+    ({'node_dummy': ([u'Your'], u'PRP$')}, 'Donor')
     """
     extractor = FeatureExtractor(feature_funcs)
     
-    training_instances = []
-    
-    for sent_str, anns in annotations:
-        tree = parser.raw_parse(sent_str).next()
+    trees = parse_sentences([sent_str for sent_str, _ in annotations], parser, parse_cache)
+    for (sent_str, anns), tree in zip(annotations, trees):
         tree = convert_brackets(tree)
         # print tree
         # some preprocessing, align the positions and 
         # also use the sentence string given the parse tree
         anns = align_annotation_with_sentence(sent_str, ' '.join(tree.leaves()), anns)
         sent_str = ' '.join(tree.leaves())
+        index = SpanIndex(tree)
+        memo = {}
+
+        # annotations of the same sentence often share the target
+        target_nodes = {}
         for ann in anns:
             frame_name = ann.frame_name
             start, end = ann.target.start, ann.target.end
             frame = Frame(start, end, frame_name)
-            frame_node = find_node_by_positions(tree, start, end)
+            if (start, end) not in target_nodes:
+                target_nodes[(start, end)] = find_node_by_positions(tree, start, end, index)
+            frame_node = target_nodes[(start, end)]
 
             # TODO: bug here
             if frame_node is None: 
                 sys.stderr.write("Warning: %r does not correspond to any tree node in sentence \"%s\"\nSkip it\n " %(frame, sent_str))
                 continue
+
+            roles = gold_roles(tree, ann, index)
+
+            nodes = collect_nodes(tree, index)
+            if pruner is not None:
+                nodes = pruner.prune(nodes, frame_node, index, roles)
                 
-            for node, (node_start_pos, node_end_pos) in collect_nodes(tree):
+            for node, (node_start_pos, node_end_pos) in nodes:
                 node_pos = NodePosition(node_start_pos, node_end_pos)
-                context = Context(sent_str, tree, frame, node_pos)
+                context = Context(sent_str, tree, frame, node_pos, index, memo)
 
                 feature_values = extractor.extract(node, context)
                 
-                # try to see the it has some semantic role
-                found_matching_node = False
-                for fe in ann.FE:
-                    other_node = find_node_by_positions(tree, fe.start, fe.end)
-                    if node == other_node:
-                        training_instances.append((feature_values, fe.name))
-                        found_matching_node = True
-                        break
+                # no semantic role => NULL
+                yield (feature_values, roles.get(id(node), NULL_LABEL))
+
+def gold_roles(tree, ann, index = None):
+    """
+    Map the tree nodes of the frame elements in `ann` to their role names.
+    Nodes are keyed by `id` as they are compared by identity.
 
-                # semantic role => NULL
-                if not found_matching_node:
-                    training_instances.append((feature_values, 'NULL'))
+    If several frame elements fall on the same node, the first one wins.
+    `index` is the `tree_util.SpanIndex` of the tree, built if not given.
+
+    >>> from nltk.tree import Tree
+    >>> from annotation import (Annotation, Target, FrameElement)
+    >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])])])
+    >>> ann = Annotation('1', '1', 'Experiencer_focus', Target(2, 5), [FrameElement(0, 0, 'Experiencer'), FrameElement(7, 9, 'Content'), FrameElement(7, 9, 'Other'), FrameElement(0, 1, 'Nothing')])
+    >>> roles = gold_roles(tree, ann)
+    >>> roles[id(tree[0][0])], roles[id(tree[0][1][1])]
+    ('Experiencer', 'Content')
+    >>> len(roles)
+    2
+    """
+    if index is None:
+        index = SpanIndex(tree)
+    roles = {}
+    for fe in ann.FE:
+        node = find_node_by_positions(tree, fe.start, fe.end, index)
+        if node is not None:
+            roles.setdefault(id(node), fe.name)
+    return roles
+
+def extract_file(path, feature_funcs, parse_cache = None, parser = None, pruner = None):
+    """
+    The training instances of the FrameNet fulltext file at `path`
+    """
+    return list(iter_file(path, feature_funcs, parse_cache, parser, pruner))
+
+def iter_file(path, feature_funcs, parse_cache = None, parser = None, pruner = None):
+    sys.stderr.write("Processing file: '%s'\n" %path)
+    annotations = parse_fulltext(path)
+    return iter_training_data(feature_funcs, annotations, parse_cache, parser, pruner)
+
+def _extract_file_worker(args):
+    path, feature_funcs, parse_cache, parser, pruner = args
+    # the worker's own copies, count from zero
+    if parse_cache is not None:
+        parse_cache.hits, parse_cache.misses = 0, 0
+    if pruner is not None:
+        pruner.reset()
+    instances = extract_file(path, feature_funcs, parse_cache, parser, pruner)
+    cache_counts = (parse_cache.hits, parse_cache.misses) if parse_cache is not None else (0, 0)
+    pruner_counts = pruner.counts() if pruner is not None else None
+    return instances, cache_counts, pruner_counts
+
+def collect_instances(paths, feature_funcs, parse_cache = None, parser = None, n_jobs = 1, pruner = None):
+    """
+    The training instances of all the fulltext files in `paths`, concatenated in the order of `paths`
 
-    return training_instances
+    If `n_jobs` > 1, the files are processed by a pool of `n_jobs` processes, largest files first.
+    The result is the same as the serial one.
 
-def phase_two_data():
+    >>> from features import ALL_FEATURES
+    >>> from parser_backend import PreparsedBackend
+    >>> parser = PreparsedBackend("test_data/parses.tsv")
+    >>> paths = ["test_data/annotation.xml", "test_data/annotation3.xml"]
+    >>> serial = collect_instances(paths, ALL_FEATURES, parser = parser)
+    >>> parallel = collect_instances(paths, ALL_FEATURES, parser = parser, n_jobs = 2)
+    >>> len(serial)
+    282
+    >>> serial == parallel
+    True
+    >>> [x.keys() for x, y in serial] == [x.keys() for x, y in parallel]
+    True
+    """
+    return list(iter_instances(paths, feature_funcs, parse_cache, parser, n_jobs, pruner))
+
+def iter_instances(paths, feature_funcs, parse_cache = None, parser = None, n_jobs = 1, pruner = None):
+    """
+    Generator version of `collect_instances`
+
+    In the serial case, one instance is held in memory at a time.
+    In the parallel case, the instances of one file are held until all the files before it are yielded.
+    """
+    if n_jobs == 1:
+        for path in paths:
+            for instance in iter_file(path, feature_funcs, parse_cache, parser, pruner):
+                yield instance
+        return
+
+    # largest files first, so that no worker is left with a big file at the end
+    order = sorted(xrange(len(paths)), key = lambda i: os.path.getsize(paths[i]), reverse = True)
+    tasks = [(paths[i], feature_funcs, parse_cache, parser, pruner) for i in order]
+
+    finished = {}
+    next_i = 0
+    pool = Pool(n_jobs)
+    try:
+        for i, (file_instances, (hits, misses), pruner_counts) in zip(order, pool.imap(_extract_file_worker, tasks)):
+            finished[i] = file_instances
+            if parse_cache is not None:
+                parse_cache.hits += hits
+                parse_cache.misses += misses
+            if pruner is not None:
+                pruner.add_counts(pruner_counts)
+
+            # yield in the order of `paths`
+            while next_i in finished:
+                for instance in finished.pop(next_i):
+                    yield instance
+                next_i += 1
+    finally:
+        pool.close()
+        pool.join()
+
+def _spill(rows, f):
+    """
+    Pass `rows` through while pickling each of them to file `f`
+    """
+    for row in rows:
+        pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+        yield row
+
+def _unspill(f):
+    """
+    Read back the rows written by `_spill`
+    """
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            break
+
+def phase_two_data(fulltext_dir = "/cs/fs2/home/hxiao/Downloads/fndata-1.5/fulltext/", size = 40, n_jobs = 1, streaming = False, n_hash_features = None, sketch_width = None, columnar = False, null_rate = None, seed = 0, prune = False, report_collisions = False):
     """
     Extract features and apply feature templating and encoding the data into matrix
+
+    The first `size` fulltext files(sorted by name, all of them if `size` is None) under `fulltext_dir` are used,
+    their features are extracted by `n_jobs` processes
+
+    If `streaming`, the instances are never collected in memory:
+    the templated features are counted while being spilled to a temporary file, which is then read back for encoding.
+    With `sketch_width`, the first pass only fills a `feature_selection.CountMinSketch` of that width
+    and the exact counting of the candidate values is done in a second pass over the spill file
+
+    If `n_hash_features` is given, the features are hashed into that many columns(see `feature_encoding.hash_encode`)
+    in one streaming pass, without feature selection.
+    With `report_collisions`, the collision rate is reported, at the cost of a fingerprint kept per distinct feature
+
+    If `columnar`, the templated features are kept as integer id columns(see `feature_template.apply_templates_columnar`),
+    which are counted and encoded with array operations instead of one dict per instance
+
+    If `prune`, only the argument candidates kept by `candidate_pruning.XuePalmerPruner` become instances
+
+    If `null_rate` is given, the NULL instances are subsampled at that rate(see `labels.subsample_null`, seeded by `seed`)
+    and the kept ones are weighted by 1 / `null_rate`
+
+    The data is written to the `dataset.Dataset` under dump/dataset and the column of each selected feature value
+    to the `vocabulary.Vocabulary` under dump/vocabulary
     """
+    if null_rate is not None: # checked before the extraction rather than after it
+        check_null_rate(null_rate)
+
+    import tempfile
     from pathlib import Path
-    try:
-        import cPickle as pickle
-    except ImportError:
-        import pickle
     
-    from annotation import parse_fulltext
     from features import ALL_FEATURES
+    from parse_cache import ParseCache
     
-    from feature_template import apply_templates
-    from feature_selection import filter_by_frequency
-    from feature_encoding import encode
+    from feature_template import (apply_templates, iter_templates, apply_templates_columnar)
+    from feature_selection import (filter_by_frequency, CountMinSketch)
+    from feature_encoding import (encode, hash_encode)
+    from vocabulary import Vocabulary
+    from dataset import write_dataset
+    from candidate_pruning import XuePalmerPruner
 
     # Feature templates considered if heading by 1:
     # ----------------------------
@@ -113,27 +336,103 @@ def phase_two_data():
     templates = [tuple([f.name]) for f in ALL_FEATURES] + \
                 [('path_to_frame', 'frame'), ('head_stem', 'frame'), ('head_stem', 'frame', 'path_to_frame'), ('head_stem', 'phrase_type')]
     
-    size = 40
-    instances = []
-    for i, p in enumerate(Path("/cs/fs2/home/hxiao/Downloads/fndata-1.5/fulltext/").glob("*.xml")):
-        if i == size:
-            break
-        sys.stderr.write("Processing file: '%s'\n" %p.absolute())
-        annotations = parse_fulltext(str(p.absolute()))
-        instances += make_training_data(ALL_FEATURES, annotations)
-
-    sys.stderr.write("Feature selection...\n")
-    x, y = zip(*instances)
-    x = apply_templates(x, templates)
-    features = filter_by_frequency(x, 5)
-    sys.stderr.write("Feature encoding...\n")
-    x, feature_map = encode(x, features)
+    paths = sorted(str(p.absolute()) for p in Path(fulltext_dir).glob("*.xml"))[:size]
+    parser = get_parser()
+    parse_cache = ParseCache('dump/parse_cache', parser.model_id, max_entries = 1000000)
+
+    pruner = XuePalmerPruner() if prune else None
+
+    y = []
+    def feature_values():
+        for feature_values, role in iter_instances(paths, ALL_FEATURES, parse_cache, parser, n_jobs, pruner):
+            y.append(role)
+            yield feature_values
+
+    if n_hash_features is not None:
+        sys.stderr.write("Feature extraction and hashing...\n")
+        x, stats = hash_encode(iter_templates(feature_values(), templates), n_hash_features, report_collisions = report_collisions)
+        feature_map = None
+        y = tuple(y)
+        if stats is not None:
+            sys.stderr.write("Hashing: %d features into %d columns(collision rate %.4f)\n" %(stats['n_keys'], stats['n_columns_used'], stats['collision_rate']))
+    elif streaming:
+        with tempfile.TemporaryFile(dir = 'dump') as spill_file:
+            rows = _spill(iter_templates(feature_values(), templates), spill_file)
+            if sketch_width is None:
+                sys.stderr.write("Feature extraction and selection...\n")
+                features = filter_by_frequency(rows, 5)
+            else:
+                sys.stderr.write("Feature extraction and sketching...\n")
+                sketch = CountMinSketch(width = sketch_width)
+                sketch.update(rows)
+                sys.stderr.write("Feature selection...\n")
+                features = filter_by_frequency(_unspill(spill_file), 5, sketch)
+            sys.stderr.write("Feature encoding...\n")
+            x, feature_map = encode(_unspill(spill_file), features)
+        y = tuple(y)
+    elif columnar:
+        sys.stderr.write("Feature extraction and templating...\n")
+        x = apply_templates_columnar(feature_values(), templates)
+        y = tuple(y)
+        sys.stderr.write("Feature selection...\n")
+        features = filter_by_frequency(x, 5)
+        sys.stderr.write("Feature encoding...\n")
+        x, feature_map = encode(x, features)
+    else:
+        instances = collect_instances(paths, ALL_FEATURES, parse_cache, parser, n_jobs, pruner)
+
+        sys.stderr.write("Feature selection...\n")
+        x, y = zip(*instances)
+        x = apply_templates(x, templates)
+        features = filter_by_frequency(x, 5)
+        sys.stderr.write("Feature encoding...\n")
+        x, feature_map = encode(x, features)
+
+    if pruner is not None:
+        sys.stderr.write(pruner.report() + "\n")
+    sys.stderr.write("Parse cache: %d hits, %d misses(hit rate %.2f)\n" %(parse_cache.hits, parse_cache.misses, parse_cache.hit_rate))
     
+    label_index = LabelIndex.fit(y)
+    weights = None
+    if null_rate is not None:
+        keep, weights = subsample_null(y, null_rate, seed)
+        sys.stderr.write("NULL subsampling: %d of %d instances kept\n" %(len(keep), len(y)))
+        x = x[keep]
+        y = [y[i] for i in keep]
+
     sys.stderr.write("Dumping data...\n")    
-    pickle.dump((x, y, ALL_FEATURES, templates, feature_map), open('dump/test_data.pkl', 'w'))
-    import pdb
-    pdb.set_trace()
-    print len(instances)
+    write_dataset('dump/dataset', x, y, label_index = label_index, weights = weights,
+                  templates = templates, n_hash_features = n_hash_features, null_rate = null_rate, seed = seed, prune = prune)
+    if feature_map is not None:
+        Vocabulary.build(feature_map, templates).save('dump/vocabulary')
 
 if __name__ == "__main__":
-    phase_two_data()
+    import argparse
+
+    parser = argparse.ArgumentParser("Extract, select and encode the features of FrameNet fulltext annotations")
+    parser.add_argument("-d", type=str, dest = "fulltext_dir",
+                        default = "/cs/fs2/home/hxiao/Downloads/fndata-1.5/fulltext/",
+                        help = "Directory of the FrameNet fulltext xml files")
+    parser.add_argument("-n", type=int, dest = "size", default = 40,
+                        help = "Number of fulltext files to use, all of them if 0")
+    parser.add_argument("-j", type=int, dest = "n_jobs", default = 1,
+                        help = "Number of processes for feature extraction")
+    parser.add_argument("--streaming", action = "store_true",
+                        help = "Stream the instances instead of holding them in memory")
+    parser.add_argument("--hash", type=int, dest = "n_hash_features",
+                        help = "Hash the features into this many columns instead of selecting them by frequency")
+    parser.add_argument("--report-collisions", action = "store_true", dest = "report_collisions",
+                        help = "With --hash, report the collision rate(keeps a fingerprint per distinct feature)")
+    parser.add_argument("--sketch", type=int, dest = "sketch_width",
+                        help = "With --streaming, select the features through a count-min sketch of this width to bound the memory")
+    parser.add_argument("--columnar", action = "store_true",
+                        help = "Template, select and encode the features as integer id columns")
+    parser.add_argument("--null-rate", type=float, dest = "null_rate",
+                        help = "Keep the NULL instances at this rate, weighting the kept ones")
+    parser.add_argument("--seed", type=int, default = 0,
+                        help = "Seed of the NULL subsampling")
+    parser.add_argument("--prune", action = "store_true",
+                        help = "Prune the argument candidates with the Xue & Palmer heuristic")
+
+    args = parser.parse_args()
+    phase_two_data(args.fulltext_dir, args.size or None, args.n_jobs, args.streaming, args.n_hash_features, args.sketch_width, args.columnar, args.null_rate, args.seed, args.prune, args.report_collisions)
@@ -0,0 +1,168 @@
+"""
+On-disk dataset of encoded instances
+
+A dataset directory contains meta.json(format version, number of rows and features, the shard sizes),
+the `labels.LabelIndex` in labels.json and one directory per shard with the CSR arrays `data.npy`, `indices.npy`, `indptr.npy`,
+the label ids `labels.npy` and the instance weights `weights.npy`.
+Shards are memory-mapped when loaded, so only the rows used are read.
+"""
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+from scipy.sparse import (csr_matrix, vstack)
+
+from labels import LabelIndex
+
+VERSION = 1
+
+
+def write_dataset(path, x, y, shard_size = 100000, label_index = None, weights = None, **meta):
+    """
+    Write the encoded data `x`(scipy.sparse matrix) and labels `y` under `path`, `shard_size` rows per shard
+
+    The dataset is written to a temporary directory next to `path` and moved in place when complete,
+    replacing the one at `path` if any, so a reader never sees a mix of two datasets
+
+    label_index: `labels.LabelIndex` of the labels, fit on `y` if not given
+    weights: instance weights(e.g. from `labels.subsample_null`), all 1 if not given
+    meta: more metadata to save, e.g. the templates
+
+    >>> import shutil, tempfile
+    >>> x = csr_matrix(np.array([[1, 0, 1], [0, 1, 0], [0, 0, 0], [1, 1, 0], [0, 0, 1]], dtype = np.int32))
+    >>> y = ['A', 'NULL', 'NULL', 'B', 'A']
+    >>> path = tempfile.mkdtemp()
+    >>> write_dataset(path, x, y, shard_size = 2, templates = [('a',)])
+    >>> dataset = Dataset(path)
+    >>> len(dataset), dataset.n_features, dataset.n_shards, dataset.labels.names, dataset.meta['templates']
+    (5, 3, 3, [u'A', u'B', u'NULL'], [[u'a']])
+    >>> x2, y2, w2 = dataset.load()
+    >>> (x2 != x).nnz, dataset.labels.decode(y2) == y, list(w2)
+    (0, True, [1.0, 1.0, 1.0, 1.0, 1.0])
+    >>> [(b.shape[0], list(l)) for b, l, _ in dataset.iter_batches(3)] # batches do not span shards
+    [(2, [0, 2]), (2, [2, 1]), (1, [0])]
+    >>> (vstack([b for b, _, _ in dataset.iter_batches(2, shuffle = True, seed = 0)]).sum(axis = 0) == x.sum(axis = 0)).all()
+    True
+    >>> write_dataset(path, x[:2], y[:2], shard_size = 2) # rewritten with fewer rows
+    >>> sorted(os.listdir(path)), len(Dataset(path))
+    (['labels.json', 'meta.json', 'shard_00000'], 2)
+    >>> shutil.rmtree(path)
+    """
+    x = csr_matrix(x)
+    if label_index is None:
+        label_index = LabelIndex.fit(y)
+    y = label_index.encode(y)
+    if weights is None:
+        weights = np.ones(len(y), dtype = np.float32)
+    assert x.shape[0] == len(y) == len(weights), "%d rows, %d labels and %d weights" %(x.shape[0], len(y), len(weights))
+
+    path = os.path.normpath(path)
+    parent = os.path.dirname(path) or '.'
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(dir = parent, prefix = os.path.basename(path) + '.tmp')
+    try:
+        _write_shards(tmp_path, x, y, shard_size, label_index, weights, meta)
+    except:
+        shutil.rmtree(tmp_path, ignore_errors = True)
+        raise
+
+    if os.path.exists(path):
+        old_path = tempfile.mkdtemp(dir = parent, prefix = os.path.basename(path) + '.old')
+        os.rename(path, os.path.join(old_path, 'dataset'))
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+
+def _write_shards(path, x, y, shard_size, label_index, weights, meta):
+    shard_rows = []
+    for i, start in enumerate(xrange(0, x.shape[0], shard_size)):
+        end = min(start + shard_size, x.shape[0])
+        shard = x[start:end]
+        shard_dir = os.path.join(path, 'shard_%05d' % i)
+        os.makedirs(shard_dir)
+        np.save(os.path.join(shard_dir, 'data.npy'), shard.data)
+        np.save(os.path.join(shard_dir, 'indices.npy'), shard.indices.astype(np.int32))
+        np.save(os.path.join(shard_dir, 'indptr.npy'), shard.indptr.astype(np.int64))
+        np.save(os.path.join(shard_dir, 'labels.npy'), y[start:end])
+        np.save(os.path.join(shard_dir, 'weights.npy'), np.asarray(weights[start:end], dtype = np.float32))
+        shard_rows.append(end - start)
+
+    label_index.save(os.path.join(path, 'labels.json'))
+    # written last
+    meta = dict(meta, version = VERSION, n_rows = x.shape[0], n_features = x.shape[1],
+                shard_rows = shard_rows)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+class Dataset(object):
+    """
+    Dataset written by `write_dataset`, shards are memory-mapped on first use
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != VERSION:
+            raise ValueError("Dataset version %d, expected %d" %(self.meta['version'], VERSION))
+        self.n_features = self.meta['n_features']
+        self.labels = LabelIndex.load(os.path.join(path, 'labels.json'))
+        self.shard_rows = self.meta['shard_rows']
+        self._shards = {}
+
+    def __len__(self):
+        return self.meta['n_rows']
+
+    @property
+    def n_shards(self):
+        return len(self.shard_rows)
+
+    def shard(self, i):
+        """
+        The CSR arrays(data, indices, indptr), the label ids and the weights of shard `i`, memory-mapped
+        """
+        if i not in self._shards:
+            shard_dir = os.path.join(self.path, 'shard_%05d' % i)
+            self._shards[i] = tuple(np.load(os.path.join(shard_dir, name + '.npy'), mmap_mode = 'r')
+                                    for name in ('data', 'indices', 'indptr', 'labels', 'weights'))
+        return self._shards[i]
+
+    def rows(self, i, start, end):
+        """
+        Rows `start` to `end` of shard `i` as a csr_matrix, their label ids and weights.
+        The data and indices are views of the mapped arrays, only indptr is rebased.
+        """
+        data, indices, indptr, labels, weights = self.shard(i)
+        begin, stop = indptr[start], indptr[end]
+        x = csr_matrix((data[begin:stop], indices[begin:stop], (indptr[start:end + 1] - begin).astype(np.int32)),
+                       shape = (end - start, self.n_features), copy = False)
+        return x, labels[start:end], weights[start:end]
+
+    def iter_batches(self, batch_size, shuffle = False, seed = None):
+        """
+        Yield (x, label ids, weights) of `batch_size` rows, batches do not span shards.
+        If `shuffle`, the order of the shards and of the batches within a shard is random(rows within a batch stay contiguous).
+        """
+        rng = np.random.RandomState(seed)
+        shards = np.arange(self.n_shards)
+        if shuffle:
+            rng.shuffle(shards)
+        for i in shards:
+            starts = np.arange(0, self.shard_rows[i], batch_size)
+            if shuffle:
+                rng.shuffle(starts)
+            for start in starts:
+                yield self.rows(i, start, min(start + batch_size, self.shard_rows[i]))
+
+    def load(self):
+        """
+        The whole dataset in memory: csr_matrix, label ids and weights
+        """
+        if self.n_shards == 0:
+            return csr_matrix((0, self.n_features), dtype = np.int32), np.zeros(0, dtype = np.int32), np.zeros(0, dtype = np.float32)
+        xs, ys, ws = zip(*[self.rows(i, 0, n) for i, n in enumerate(self.shard_rows)])
+        return vstack(xs, format = 'csr'), np.concatenate(ys), np.concatenate(ws)
@@ -0,0 +1,197 @@
+"""
+Binary cache of parsed dependency output
+
+The `DepParseResult`s of a CoreNLP output file are saved next to it in `<path>.npz`:
+one string table(the tokens, POS tags, relations and sentences, utf8 and newline-joined) and int32 arrays
+of string ids and token indices, so that loading them back is reading a few arrays and decoding the table once.
+The size and mtime of the output file are saved in the cache, which is used while they have not changed.
+"""
+import os
+import sys
+import codecs
+import tempfile
+import zipfile
+
+import numpy as np
+
+from dependency_output_parser import (Node, Edge, DepParseResult, ROOT, iter_output, iter_conll)
+from file_util import write_atomic
+
+VERSION = 2
+
+CONLL_EXTENSIONS = ('.conll', '.conllx')
+
+
+def save_results(results, path, source_signature = (-1, -1.)):
+    """
+    Save the `DepParseResult`s `results` to `path`(.npz)
+
+    source_signature: (size, mtime) of the output file `results` were parsed from, see `source_signature`
+
+    >>> import shutil
+    >>> from dependency_output_parser import parse_output
+    >>> results = parse_output(codecs.open('test_data/depparse_output1.out', 'r', 'utf8'))
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> save_results(results, os.path.join(tmp_dir, 'out.npz'))
+    >>> loaded = load_results(os.path.join(tmp_dir, 'out.npz'))
+    >>> [(r.sent_id, r.sentence, r.nodes, r.edges) for r in loaded] == [(r.sent_id, r.sentence, r.nodes, r.edges) for r in results]
+    True
+    >>> [n.pos_tag for n in loaded[0].nodes] == [n.pos_tag for n in results[0].nodes]
+    True
+    >>> loaded[0].edges[0]
+    (ROOT-0, Objectives(NNS)-1, root)
+    >>> shutil.rmtree(tmp_dir)
+    """
+    strings = {}
+    def string_id(s):
+        if s is None:
+            return -1
+        return strings.setdefault(s, len(strings))
+
+    sent_ids, sentences, n_tokens, n_edges = [], [], [], []
+    tokens, pos, edge_from, edge_to, edge_rel = [], [], [], [], []
+    for r in results:
+        if r.nodes[0] != ROOT:
+            raise ValueError("Sentence %d does not start with the root" %(r.sent_id))
+        sent_ids.append(r.sent_id)
+        sentences.append(string_id(r.sentence))
+        n_tokens.append(len(r.nodes) - 1)
+        n_edges.append(len(r.edges))
+        for node in r.nodes[1:]:
+            tokens.append(string_id(node.token))
+            pos.append(string_id(node.pos_tag))
+        for e in r.edges:
+            edge_from.append(e.from_node.index)
+            edge_to.append(e.to_node.index)
+            edge_rel.append(string_id(e.edge_type))
+
+    table = sorted(strings, key = strings.get)
+    if any(u'\n' in s for s in table):
+        raise ValueError("Strings with line breaks cannot be cached")
+    blob = u'\n'.join(s if isinstance(s, unicode) else s.decode('utf8') for s in table).encode('utf8')
+
+    arrays = dict(version = np.array([VERSION], dtype = np.int32),
+                  source_size = np.array([source_signature[0]], dtype = np.int64),
+                  source_mtime = np.array([source_signature[1]], dtype = np.float64),
+                  strings = np.frombuffer(blob, dtype = np.uint8),
+                  n_strings = np.array([len(table)], dtype = np.int32))
+    for name, values in [('sent_ids', sent_ids), ('sentences', sentences), ('n_tokens', n_tokens), ('n_edges', n_edges),
+                         ('tokens', tokens), ('pos', pos),
+                         ('edge_from', edge_from), ('edge_to', edge_to), ('edge_rel', edge_rel)]:
+        arrays[name] = np.array(values, dtype = np.int32)
+
+    # written to a temporary file first, a reader never sees a partial cache
+    write_atomic(path, lambda f: np.savez(f, **arrays))
+
+def load_results(path):
+    """
+    The `DepParseResult`s saved by `save_results` at `path`, the strings are unicode
+    """
+    with np.load(path) as arrays:
+        if arrays['version'][0] != VERSION:
+            raise ValueError("Dependency cache version %d, expected %d" %(arrays['version'][0], VERSION))
+        n_strings = arrays['n_strings'][0]
+        table = arrays['strings'].tostring().decode('utf8').split(u'\n') if n_strings > 0 else []
+        table.append(None) # string id -1
+        sent_ids, sentences, n_tokens, n_edges, tokens, pos, edge_from, edge_to, edge_rel = \
+            [arrays[name].tolist() for name in ('sent_ids', 'sentences', 'n_tokens', 'n_edges',
+                                                'tokens', 'pos', 'edge_from', 'edge_to', 'edge_rel')]
+
+    results = []
+    token_start = edge_start = 0
+    for sent_id, sentence, n_token, n_edge in zip(sent_ids, sentences, n_tokens, n_edges):
+        token_end, edge_end = token_start + n_token, edge_start + n_edge
+        nodes = [ROOT]
+        for i, (token, tag) in enumerate(zip(tokens[token_start:token_end], pos[token_start:token_end])):
+            nodes.append(Node(table[token], i + 1, table[tag]))
+        edges = [Edge(nodes[f], nodes[t], table[rel])
+                 for f, t, rel in zip(edge_from[edge_start:edge_end], edge_to[edge_start:edge_end], edge_rel[edge_start:edge_end])]
+        r = DepParseResult(sent_id, u'', nodes, edges)
+        r.sentence = table[sentence] # saved escaped already
+        results.append(r)
+        token_start, edge_start = token_end, edge_end
+    return results
+
+def cache_path(path):
+    return path + '.npz'
+
+def source_signature(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+def is_fresh(path):
+    """
+    Whether the cache of the output file `path` exists and was written from the file of the current size and mtime
+    """
+    cache = cache_path(path)
+    if not os.path.exists(cache):
+        return False
+    try:
+        with np.load(cache) as arrays:
+            if arrays['version'][0] != VERSION:
+                return False
+            saved = (int(arrays['source_size'][0]), float(arrays['source_mtime'][0]))
+    except (IOError, ValueError, KeyError, zipfile.BadZipfile):
+        return False
+    return saved == source_signature(path)
+
+def read_output(path):
+    """
+    Parse the output file `path`, CoNLL if its extension is in `CONLL_EXTENSIONS`, otherwise the text output of CoreNLP
+    """
+    with codecs.open(path, 'r', 'utf8') as f:
+        if os.path.splitext(path)[1] in CONLL_EXTENSIONS:
+            return list(iter_conll(f))
+        else:
+            return list(iter_output(f))
+
+def load_output(path, use_cache = True):
+    """
+    The `DepParseResult`s of the output file `path`, from its cache if fresh.
+    Otherwise the file is parsed and the cache written(a cache that cannot be written is warned about and skipped).
+
+    >>> import shutil
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> path = os.path.join(tmp_dir, 'sent.txt.out')
+    >>> shutil.copy('test_data/depparse_output1.out', path)
+    >>> is_fresh(path)
+    False
+    >>> r = load_output(path)
+    >>> is_fresh(path), load_output(path)[0].nodes == r[0].nodes
+    (True, True)
+    >>> mtime = os.path.getmtime(path)
+    >>> os.utime(path, (mtime + 10, mtime + 10)) # touched
+    >>> is_fresh(path)
+    False
+    >>> len(load_output(path)), is_fresh(path)
+    (1, True)
+    >>> with open(path, 'a') as f: f.write('\\n') # changed, with the mtime kept
+    >>> os.utime(path, (mtime + 10, mtime + 10))
+    >>> is_fresh(path)
+    False
+    >>> shutil.rmtree(tmp_dir)
+    """
+    if use_cache and is_fresh(path):
+        try:
+            return load_results(cache_path(path))
+        except (IOError, ValueError, KeyError, zipfile.BadZipfile) as e:
+            sys.stderr.write("Ignoring the unreadable cache of %s: %s\n" %(path, e))
+
+    signature = source_signature(path) # before reading, a change while parsing makes the cache stale
+    results = read_output(path)
+    if use_cache:
+        try:
+            save_results(results, cache_path(path), signature)
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("Cannot write the cache of %s: %s\n" %(path, e))
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Write the binary cache of dependency parser output files")
+    parser.add_argument("paths", nargs = "+", help = "CoreNLP output files(.out, or .conll)")
+    args = parser.parse_args()
+    for path in args.paths:
+        if not is_fresh(path):
+            load_output(path)
@@ -15,7 +15,19 @@ import operator
 import textwrap
 from StringIO import StringIO
 
-__all__ = ["parse_output"]
+__all__ = ["parse_output", "iter_output", "iter_conll"]
+
+# one copy of each POS tag and edge type string, shared by all the nodes and edges.
+# Only these small vocabularies are interned, the tokens are not, so the tables do not grow with the corpus.
+# str and unicode are kept apart as equal ones compare and hash the same
+_strings = {}
+_unicode_strings = {}
+
+def _intern(s):
+    if s is None:
+        return None
+    table = _unicode_strings if isinstance(s, unicode) else _strings
+    return table.setdefault(s, s)
 
 class Node(object):
     u"""
@@ -47,12 +59,29 @@ class Node(object):
     >>> n = Node.load_from_str(u"feng-1", [Node('ROOT', 0), Node('feng', 1, "BB")])
     >>> print n
     feng(BB)-1
-
+    >>> hash(n1) == hash(n3), n1 != n3
+    (True, False)
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(n1)) == n1, pickle.loads(pickle.dumps(n1, 2)).pos_tag
+    (True, 'ADJ')
     """
+    # nodes are many and are used as dict keys:
+    # no __dict__ per node and the hash computed once from (token, index), as `__eq__` compares them
+    __slots__ = ('token', 'index', 'pos_tag', '_hash')
+
     def __init__(self, token, index, pos_tag=None):
         self.token = token
         self.index = index
-        self.pos_tag = pos_tag
+        self.pos_tag = _intern(pos_tag)
+        self._hash = hash((token, index))
+
+    def __getstate__(self):
+        return (self.token, self.index, self.pos_tag)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict): # pickled before the slots
+            state = (state['token'], state['index'], state.get('pos_tag'))
+        self.__init__(*state)
     
     def __unicode__(self):
         if self.index == 0 or self.pos_tag == None:
@@ -68,8 +97,11 @@ class Node(object):
             return False
         else:
             return other.token == self.token and other.index == self.index
+    def __ne__(self, other):
+        return not self == other
+
     def __hash__(self):
-        return hash(repr(self))
+        return self._hash
 
     @property        
     def dot_str(self):
@@ -81,7 +113,9 @@ class Node(object):
         all_nodes can be either dictionary(word index -> Node) or list of Nodes in sentence word order
         """
         # last occuring '-' position
-        last_hyphen_index = len(s) - s[::-1].index('-') - 1
+        last_hyphen_index = s.rfind('-')
+        if last_hyphen_index < 0:
+            raise ValueError("No hyphen in s = %s" %(s))
 
         token = s[:last_hyphen_index]
         try:
@@ -98,14 +132,30 @@ class Node(object):
 ROOT = Node("ROOT", 0)
 
 class Edge(tuple):
+    """
+    >>> e = Edge(Node('love', 2, 'VBP'), Node('you', 3, 'PRP'), 'dobj')
+    >>> e.to_node, e.edge_type
+    (you(PRP)-3, 'dobj')
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(e)) == e, pickle.loads(pickle.dumps(e, 2)).from_node
+    (True, love(VBP)-2)
+    """
+    # the fields are the tuple items, no __dict__ per edge
+    __slots__ = ()
+
     def __new__(cls, from_node, to_node, edge_type):
         # tule is inmutable, so __new__ should be called
-        obj = tuple.__new__(Edge, [from_node, to_node, edge_type])
-        obj.from_node = from_node
-        obj.to_node   = to_node  
-        obj.edge_type = edge_type
-        
-        return obj
+        return tuple.__new__(Edge, [from_node, to_node, _intern(edge_type)])
+
+    from_node = property(operator.itemgetter(0))
+    to_node = property(operator.itemgetter(1))
+    edge_type = property(operator.itemgetter(2))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __setstate__(self, state):
+        pass # pickled before the slots, with the fields in __dict__ as well
         
     def __unicode__(self):
         return u"(%s, %s, %s)" %(unicode(self.from_node), 
@@ -125,6 +175,12 @@ class Edge(tuple):
         else:
             return other.from_node == self.from_node and other.to_node == self.to_node and other.edge_type == self.edge_type
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return tuple.__hash__(self)
+
 class DepParseResult(object):
     """
     Dependency parse result
@@ -162,6 +218,10 @@ class DepParseResult(object):
         return output
 
 find_seg_regexp = re.compile(r"\[(\S+\s?){4}\]")
+# one token segment of the token&POS line: its text and POS tag
+token_seg_regexp = re.compile(r"\[Text=(\S*) CharacterOffsetBegin=\S* CharacterOffsetEnd=\S* PartOfSpeech=(\S*)\](?=\s|$)")
+# an edge line: edge type, from token index, to token index(the tokens are looked up by index)
+edge_line_regexp = re.compile(r"^([^(]*)\((.*)-(\d+)'*, (.*)-(\d+)'*\)$")
 def parse_token_pos_line(l, prepend_root = True):
     """
     Parsing the line containing tokens and POS tags information
@@ -178,22 +238,16 @@ def parse_token_pos_line(l, prepend_root = True):
     [Electric(NNP)-1]
     """
 
-    def parse_seg(seg_str):
-        text_str, _, _, pos_str = seg_str.split()
-        try:
-            return text_str.split('=')[1], pos_str.split('=')[1]
-        except IndexError:
-            raise IndexError("text_str=%s, pos_str=%s" %(text_str, pos_str))
-
-    segs = l.strip()[1:-1].split('] [')
     nodes = (
         [ROOT] if prepend_root else []
      )
 
-    for i, seg in enumerate(segs):
-        token, pos = parse_seg(seg)
+    for i, m in enumerate(token_seg_regexp.finditer(l)):
+        token, pos = m.groups()
         nodes.append(Node(token, i+1, pos))
 
+    if len(nodes) == int(prepend_root) and len(l.strip()) > 0:
+        raise ValueError("No token in `%s`" %(l))
     return nodes
 
 def parse_edge_line(l, nodes):
@@ -224,23 +278,14 @@ def parse_edge_line(l, nodes):
     >>> parse_edge_line(u"nn(Systems-14, Centre-13)", nodes)
     (Systems(NNPS)-14, Centre(NNP)-13, nn)
     """
-    try:
-        paren_pos = l.index('(') # pos of the first paren, where we split
-    except ValueError:
-        raise ValueError("Trying to find parenthesis in `%s`" %(l))
-
-    edge_type = l[:paren_pos]
-
-    rest = l[paren_pos+1:][:-1]
-    try:
-        from_node, to_node = map(
-            lambda s: Node.load_from_str(s, nodes), 
-            rest.split(', ')
-        )
-    except ValueError:
-        raise ValueError("Splitting `%s` by `, `" %(rest))
-    
-    return Edge(from_node, to_node, edge_type)
+    m = edge_line_regexp.match(l)
+    if m is None:
+        raise ValueError("Cannot parse the edge line `%s`" %(l))
+    edge_type, from_token, from_index, to_token, to_index = m.groups()
+    if nodes:
+        return Edge(nodes[int(from_index)], nodes[int(to_index)], edge_type)
+    else:
+        return Edge(Node(from_token, int(from_index)), Node(to_token, int(to_index)), edge_type)
 
 def parse_output(obj):
     """
@@ -251,8 +296,7 @@ def parse_output(obj):
     
     Return:
     -------
-    The node lists
-    The edges
+    The list of `DepParseResult`, see `iter_output`
 
     >>> from codecs import open
     >>> t1 = parse_output(open("data/test_parse_tree.txt", "r", "utf8"))
@@ -271,40 +315,107 @@ def parse_output(obj):
     >>> len(t3) 
     2
     """
+    return list(iter_output(obj))
+
+def iter_output(obj):
+    """
+    Generator version of `parse_output`, yielding the `DepParseResult` of one sentence at a time,
+    so that the memory used does not grow with the size of `obj`
+
+    >>> results = iter_output(open("test_data/depparse_output1.out"))
+    >>> r = results.next()
+    >>> r.sent_id, len(r.nodes), len(r.edges)
+    (1, 26, 20)
+    >>> r.edges[:2]
+    [(ROOT-0, Objectives(NNS)-1, root), (QAEDA(NNP)-4, AL(NNP)-3, nn)]
+    >>> list(results)
+    []
+    """
     SENT_PREFIX = "Sentence #"
     if isinstance(obj, basestring):
         obj = StringIO(obj)
     else:
-        assert hasattr(obj, 'readline'), "obj should have `readline` method "
-        assert hasattr(obj, 'readlines'), "obj should have `readlines` method "
-        
-    results = []
-    
-    sent_id = 1
-    
+        assert hasattr(obj, '__iter__'), "obj should be iterable by lines"
+    lines = iter(obj)
+
     # spends the first line as it's useless        
-    l = obj.readline()
+    l = next(lines, '')
     assert l.startswith(SENT_PREFIX)
+
+    sent_id = 1
     while True:
-        sentence = obj.readline().strip()
+        sentence = next(lines, '').strip()
         
         if len(sentence) == 0: #end of story
             break
             
-        nodes = parse_token_pos_line(obj.readline(),  
+        nodes = parse_token_pos_line(next(lines, ''),  
                                      prepend_root = True)
         edges = []
-        for l in obj:
+        for l in lines:
             if len(l.strip()) == 0: # skip non-sense lines
                 continue
             if l.startswith(SENT_PREFIX):
                 break
             edges.append(parse_edge_line(l.strip(), nodes))
             
-        results.append(DepParseResult(sent_id, sentence, nodes, edges))
+        yield DepParseResult(sent_id, sentence, nodes, edges)
         sent_id += 1
 
-    return results
+def iter_conll(obj):
+    """
+    Yield the `DepParseResult` of each sentence of CoNLL output(`-outputFormat conll` of CoreNLP),
+    one token per line, tab-separated, sentences separated by blank lines.
+
+    Both the 7 columns of CoreNLP(index, word, lemma, POS, NER, head, relation)
+    and the 10 columns of CoNLL-X(POS tag in the 5th, head and relation in the 7th and 8th) are read.
+    A token whose head is `_` has no edge.
+    As the sentence text is not in the output, it is the tokens joined by spaces.
+
+    >>> conll = "1\\tI\\tI\\tPRP\\tO\\t2\\tnsubj\\n2\\tlove\\tlove\\tVBP\\tO\\t0\\troot\\n3\\tyou\\tyou\\tPRP\\tO\\t2\\tdobj\\n\\n1\\tHi\\thi\\tUH\\tO\\t0\\troot\\n"
+    >>> r1, r2 = iter_conll(conll)
+    >>> r1.sent_id, r1.sentence, r1.nodes
+    (1, 'I love you', [ROOT-0, I(PRP)-1, love(VBP)-2, you(PRP)-3])
+    >>> r1.edges
+    [(love(VBP)-2, I(PRP)-1, nsubj), (ROOT-0, love(VBP)-2, root), (love(VBP)-2, you(PRP)-3, dobj)]
+    >>> r2.sent_id, r2.edges
+    (2, [(ROOT-0, Hi(UH)-1, root)])
+    >>> r, = iter_conll("1\\tHi\\t_\\tUH\\tUH\\t_\\t_\\t_\\t_\\t_\\n") # CoNLL-X without the dependencies
+    >>> r.nodes, r.edges
+    ([ROOT-0, Hi(UH)-1], [])
+    """
+    if isinstance(obj, basestring):
+        obj = StringIO(obj)
+
+    sent_id = 1
+    rows = []
+    for l in obj:
+        l = l.rstrip('\r\n')
+        if len(l.strip()) > 0:
+            rows.append(l.split('\t'))
+            continue
+        if len(rows) > 0:
+            yield _conll_result(sent_id, rows)
+            sent_id += 1
+            rows = []
+    if len(rows) > 0:
+        yield _conll_result(sent_id, rows)
+
+def _conll_result(sent_id, rows):
+    if len(rows[0]) >= 10:
+        pos_col, head_col, rel_col = 4, 6, 7
+    else:
+        pos_col, head_col, rel_col = 3, 5, 6
+
+    nodes = [ROOT]
+    for i, cols in enumerate(rows):
+        if int(cols[0]) != i + 1:
+            raise ValueError("Token %s of sentence %d is not at position %d" %(cols[0], sent_id, i + 1))
+        nodes.append(Node(cols[1], i + 1, cols[pos_col]))
+    edges = [Edge(nodes[int(cols[head_col])], nodes[i + 1], cols[rel_col])
+             for i, cols in enumerate(rows)
+             if cols[head_col] != '_'] # no head given
+    return DepParseResult(sent_id, ' '.join(n.token for n in nodes[1:]), nodes, edges)
 
 if __name__ == "__main__":
     import argparse, os
@@ -1,15 +1,22 @@
+import os
 import sys
-import networkx as nx
-from collections import Counter
+import codecs
+from array import array
+from multiprocessing import Pool
+from collections import (Counter, deque)
 from pathlib import Path
 import cPickle as pickle
 from annotation import align_annotation_with_sentence
 from ling_util import convert_bracket_for_token
+from file_util import pickle_atomic
 
 class DependencyTree(object):
     """
     Data wrapper for dependency tree in format of graph as well as the edge to label mapping
 
+    Paths are found over a head array(the head and the edge label of every token) and the depths of the tokens,
+    built on first use, so trees pickled before still work. `g`, the networkx graph, is only there if built by `to_graph`.
+
     >>> from dependency_output_parser import parse_output
     >>> o = parse_output(open('test_data/depparse_output1.out'))[0]
     >>> t = to_graph(o.nodes, o.edges)
@@ -29,6 +36,155 @@ class DependencyTree(object):
     def get_node(self, token, index):
         return self.wp2node[(token, index)]
 
+    def _build_heads(self):
+        """
+        Build the head array, the children lists and the depths from the edges
+
+        A node is the position of its token in `all_nodes`.
+        Collapsed dependencies can give a token several heads: the first edge(in token order) is kept as the head
+        and the token is recorded in `multi_head_nodes`. Downward paths(`downward_paths`) follow all the edges.
+        """
+        n = len(self.all_nodes)
+        self._position = dict((node.index, i) for i, node in enumerate(self.all_nodes))
+        heads = array('i', [-1] * n)
+        head_labels = [None] * n
+        children = [[] for _ in xrange(n)]
+        in_graph = [False] * n
+        multi_head_nodes = set()
+        for (f, t), label in sorted(self.e2l.items(), key = lambda e: (e[0][0].index, e[0][1].index)):
+            fi, ti = self._position[f.index], self._position[t.index]
+            children[fi].append((ti, label))
+            in_graph[fi] = in_graph[ti] = True
+            if heads[ti] == -1:
+                heads[ti] = fi
+                head_labels[ti] = label
+            else:
+                multi_head_nodes.add(self.all_nodes[ti])
+
+        depths = array('i', [-1] * n)
+        for i in xrange(n):
+            chain = []
+            j = i
+            while depths[j] == -1:
+                chain.append(j)
+                if heads[j] == -1 or heads[j] in chain: # a root, or a cycle broken here
+                    heads[j] = -1
+                    depths[j] = 0
+                    chain.pop()
+                    break
+                j = heads[j]
+            for k in reversed(chain):
+                depths[k] = depths[heads[k]] + 1
+
+        self._heads, self._head_labels, self._children = heads, head_labels, children
+        self._depths, self._in_graph = depths, in_graph
+        self.multi_head_nodes = multi_head_nodes
+
+    def _node_position(self, node):
+        """
+        The position of `node` if it's a token of the tree in the graph, otherwise None
+        """
+        if getattr(self, '_heads', None) is None:
+            self._build_heads()
+        i = self._position.get(node.index)
+        if i is None or self.all_nodes[i] != node or not self._in_graph[i]:
+            return None
+        return i
+
+    def path(self, src, dest):
+        """
+        The path from `src` up to the lowest common ancestor and down to `dest`,
+        each edge label followed by 'u'(going up to the head) or 'd'(going down to a dependent).
+        None if the nodes are not connected.
+
+        >>> from dependency_output_parser import (parse_output, Node)
+        >>> o = parse_output(open('test_data/depparse_output1.out'))[0]
+        >>> t = to_tree(o.nodes, o.edges)
+        >>> the, god = Node('the', 19, 'DT'), Node('God', 7, 'NNP')
+        >>> t.path(Node('Objectives', 1, 'NNS'), the)
+        ('dep', 'd', 'conj_and', 'd', 'prep_of', 'd', 'det', 'd')
+        >>> t.path(the, god)
+        ('det', 'u', 'prep_of', 'u', 'conj_and', 'u', 'poss', 'd')
+        >>> t.path(god, god)
+        ()
+        >>> print t.path(the, Node('of', 2, 'IN')) # not in the graph
+        None
+        """
+        a, b = self._node_position(src), self._node_position(dest)
+        if a is None or b is None:
+            return None
+        heads, head_labels, depths = self._heads, self._head_labels, self._depths
+
+        up, down = [], []
+        while depths[a] > depths[b]:
+            up.append(head_labels[a])
+            a = heads[a]
+        while depths[b] > depths[a]:
+            down.append(head_labels[b])
+            b = heads[b]
+        while a != b:
+            if heads[a] == -1: # different trees
+                return None
+            up.append(head_labels[a])
+            a = heads[a]
+            down.append(head_labels[b])
+            b = heads[b]
+
+        path = []
+        for label in up:
+            path += [label, 'u']
+        for label in reversed(down):
+            path += [label, 'd']
+        return tuple(path)
+
+    def paths_from(self, src):
+        """
+        The `path` from `src` to every node connected to it, in one walk over the tree
+
+        >>> from dependency_output_parser import (parse_output, Node)
+        >>> o = parse_output(open('test_data/depparse_output1.out'))[0]
+        >>> t = to_tree(o.nodes, o.edges)
+        >>> the = Node('the', 19, 'DT')
+        >>> paths = t.paths_from(the)
+        >>> all(paths[n] == t.path(the, n) for n in paths), len(paths)
+        (True, 21)
+        """
+        i = self._node_position(src)
+        if i is None:
+            return {}
+        heads, head_labels, children = self._heads, self._head_labels, self._children
+
+        paths = {}
+        stack = [(i, (), -1)]
+        while stack:
+            j, path, came_from = stack.pop()
+            paths[self.all_nodes[j]] = path
+            if heads[j] != -1 and heads[j] != came_from:
+                stack.append((heads[j], path + (head_labels[j], 'u'), j))
+            for child, label in children[j]:
+                if heads[child] == j and child != came_from: # the tree edges only
+                    stack.append((child, path + (label, 'd'), j))
+        return paths
+
+    def downward_paths(self, src):
+        """
+        The shortest path(edge labels) from `src` down to every node reachable by following the edges
+        """
+        i = self._node_position(src)
+        if i is None:
+            return {}
+        children = self._children
+
+        paths = {i: ()}
+        queue = deque([i])
+        while queue:
+            j = queue.popleft()
+            for child, label in children[j]:
+                if child not in paths:
+                    paths[child] = paths[j] + (label, )
+                    queue.append(child)
+        return dict((self.all_nodes[j], path) for j, path in paths.items())
+
     def tokens(self):
         tokens = [convert_bracket_for_token(n.token) for n in self.all_nodes]
         if tokens[0] == 'ROOT':
@@ -46,15 +202,14 @@ def to_graph(nodes, edges):
     >>> t = to_graph(o.nodes, o.edges)
     >>> len(t.g.nodes()) # preposition words such as in, of are omitted
     21
-    >>> t.g.nodes()
-    [QAEDA(NNP)-4, AL(NNP)-3, Islamic(JJ)-13, rule(NN)-14, Caliphate(NN)-21, the(DT)-19, :(:)-5, .(.)-25, restoration(NN)-17, ,(,)-22, Support(NN)-6, God(NNP)-7, ,(,)-15, ,(,)-10, establishment(NN)-11, religion(NN)-9, ROOT-0, God(NNP)-23, Objectives(NNS)-1, Islamic(JJ)-20, willing(JJ)-24]
+    >>> sorted(t.g.nodes(), key = lambda n: n.index)
+    [ROOT-0, Objectives(NNS)-1, AL(NNP)-3, QAEDA(NNP)-4, :(:)-5, Support(NN)-6, God(NNP)-7, religion(NN)-9, ,(,)-10, establishment(NN)-11, Islamic(JJ)-13, rule(NN)-14, ,(,)-15, restoration(NN)-17, the(DT)-19, Islamic(JJ)-20, Caliphate(NN)-21, ,(,)-22, God(NNP)-23, willing(JJ)-24, .(.)-25]
     >>> len(t.g.edges())
     20
-    >>> t.g.edges()
-    [(QAEDA(NNP)-4, AL(NNP)-3), (rule(NN)-14, Islamic(JJ)-13), (Caliphate(NN)-21, the(DT)-19), (Caliphate(NN)-21, Islamic(JJ)-20), (restoration(NN)-17, Caliphate(NN)-21), (God(NNP)-7, Support(NN)-6), (establishment(NN)-11, rule(NN)-14), (religion(NN)-9, restoration(NN)-17), (religion(NN)-9, God(NNP)-23), (religion(NN)-9, ,(,)-22), (religion(NN)-9, God(NNP)-7), (religion(NN)-9, ,(,)-15), (religion(NN)-9, ,(,)-10), (religion(NN)-9, establishment(NN)-11), (ROOT-0, Objectives(NNS)-1), (God(NNP)-23, willing(JJ)-24), (Objectives(NNS)-1, QAEDA(NNP)-4), (Objectives(NNS)-1, :(:)-5), (Objectives(NNS)-1, .(.)-25), (Objectives(NNS)-1, religion(NN)-9)]
-    >>> t.e2l    
-    {(QAEDA(NNP)-4, AL(NNP)-3): 'nn', (Objectives(NNS)-1, QAEDA(NNP)-4): 'prep_of', (religion(NN)-9, ,(,)-15): 'punct', (religion(NN)-9, restoration(NN)-17): 'conj_and', (religion(NN)-9, God(NNP)-7): 'poss', (restoration(NN)-17, Caliphate(NN)-21): 'prep_of', (Objectives(NNS)-1, .(.)-25): 'punct', (establishment(NN)-11, rule(NN)-14): 'prep_of', (God(NNP)-23, willing(JJ)-24): 'amod', (Objectives(NNS)-1, religion(NN)-9): 'dep', (Caliphate(NN)-21, Islamic(JJ)-20): 'amod', (ROOT-0, Objectives(NNS)-1): 'root', (religion(NN)-9, ,(,)-22): 'punct', (religion(NN)-9, God(NNP)-23): 'appos', (religion(NN)-9, establishment(NN)-11): 'conj_and', (rule(NN)-14, Islamic(JJ)-13): 'amod', (religion(NN)-9, ,(,)-10): 'punct', (God(NNP)-7, Support(NN)-6): 'nn', (Objectives(NNS)-1, :(:)-5): 'punct', (Caliphate(NN)-21, the(DT)-19): 'det'}
+    >>> sorted((f.index, t.index, l) for (f, t), l in t.e2l.items())
+    [(0, 1, 'root'), (1, 4, 'prep_of'), (1, 5, 'punct'), (1, 9, 'dep'), (1, 25, 'punct'), (4, 3, 'nn'), (7, 6, 'nn'), (9, 7, 'poss'), (9, 10, 'punct'), (9, 11, 'conj_and'), (9, 15, 'punct'), (9, 17, 'conj_and'), (9, 22, 'punct'), (9, 23, 'appos'), (11, 14, 'prep_of'), (14, 13, 'amod'), (17, 21, 'prep_of'), (21, 19, 'det'), (21, 20, 'amod'), (23, 24, 'amod')]
     """
+    import networkx as nx
     g = nx.DiGraph()
     
     e2l = {}
@@ -63,9 +218,26 @@ def to_graph(nodes, edges):
         e2l[(f,t)] = l
     return DependencyTree(g, e2l, nodes)
 
+def to_tree(nodes, edges):
+    """
+    Same as `to_graph`, without building the networkx graph
+
+    >>> from dependency_output_parser import parse_output
+    >>> o = parse_output(open('test_data/depparse_output1.out'))[0]
+    >>> t = to_tree(o.nodes, o.edges)
+    >>> t.e2l == to_graph(o.nodes, o.edges).e2l, t.multi_head_nodes
+    (True, set([]))
+    """
+    e2l = {}
+    for f, t, l in edges:
+        e2l[(f,t)] = l
+    tree = DependencyTree(None, e2l, nodes)
+    tree._build_heads()
+    return tree
+
 def get_path(t, src, dest):
     """
-    Get the path from src to dest in dependency parse tree
+    Get the path from src to dest in dependency parse tree, following the edges downwards only
     
     >>> from dependency_output_parser import (parse_output, Node)
     >>> o = parse_output(open('test_data/depparse_output1.out'))[0]
@@ -79,19 +251,7 @@ def get_path(t, src, dest):
     >>> print get_path(t, the, Node('random_node', 10001, 'WQR'))
     None
     """
-    nodes = t.g.nodes()
-    if src not in nodes or dest not in nodes:
-        return None
-
-    try:
-        path = nx.shortest_path(t.g, src, dest)
-    except nx.NetworkXNoPath:
-        return None
-
-    labels = []
-    for i in xrange(len(path)-1):    
-        labels.append(t.e2l[(path[i], path[i+1])])
-    return tuple(labels)
+    return t.downward_paths(src).get(dest)
 
 def get_word_indices_by_char_index_range(words, start, end):
     """
@@ -181,24 +341,38 @@ def get_annotation_nodes(aligned_annotations, t):
         result.append(frame_data)
     return result
 
-def count_path_from_nodes_pairs(t, nodes_pairs):
+def count_path_from_nodes_pairs(t, nodes_pairs, downward_only = False):
     """
     Given the tree and (frame_nodes, annotation nodes), count the paths from frame_nodes to annotation nodes
+
+    The paths are those of `DependencyTree.paths_from`, going up and down with the direction markers,
+    so an annotation node that is not below the frame node is counted as well.
+    With `downward_only`, only the paths following the edges downwards are counted, without markers,
+    which were the only counts before.
+
     >>> from pickle import load
     >>> t = load(open('test_data/tree.pkl', 'r'))
     >>> nodes_pairs = load(open('test_data/nodes_pairs.pkl', 'r'))
     >>> count_path_from_nodes_pairs(t, nodes_pairs[:1])
+    Counter({('prep_of', 'd', 'nn', 'd'): 1, ('prep_of', 'd'): 1, ('punct', 'd'): 1})
+    >>> count_path_from_nodes_pairs(t, nodes_pairs[:5]) # the ones going up are counted as well
+    Counter({('prep_of', 'd'): 2, ('nn', 'u'): 2, ('punct', 'd'): 1, ('amod', 'u'): 1, ('nn', 'u', 'poss', 'u'): 1, ('prep_of', 'd', 'nn', 'd'): 1, ('amod', 'd'): 1, ('prep_of', 'd', 'amod', 'd'): 1})
+    >>> count_path_from_nodes_pairs(t, nodes_pairs[:1], downward_only = True)
     Counter({('prep_of', 'nn'): 1, ('prep_of',): 1, ('punct',): 1})
-    >>> count_path_from_nodes_pairs(t, nodes_pairs[:2])
+    >>> count_path_from_nodes_pairs(t, nodes_pairs[:2], downward_only = True)
     Counter({('prep_of', 'nn'): 1, ('prep_of',): 1, ('punct',): 1})
-    >>> count_path_from_nodes_pairs(t, nodes_pairs[:3])
+    >>> count_path_from_nodes_pairs(t, nodes_pairs[:3], downward_only = True)
     Counter({('prep_of',): 2, ('prep_of', 'nn'): 1, ('prep_of', 'amod'): 1, ('punct',): 1})
-    >>> count_path_from_nodes_pairs(t, nodes_pairs[:5])
+    >>> count_path_from_nodes_pairs(t, nodes_pairs[:5], downward_only = True)
     Counter({('prep_of',): 2, ('amod',): 1, ('prep_of', 'nn'): 1, ('prep_of', 'amod'): 1, ('punct',): 1})
     """
     c = Counter()
     for frame_nodes, ann_nodes in nodes_pairs:
         for fn in frame_nodes:
+            if downward_only:
+                paths = t.downward_paths(fn)
+            else:
+                paths = t.paths_from(fn)
             flattend_nodes = []
             for nodes in ann_nodes: # flatten 2d list
                 if len(nodes) == 1: #iterate tuple(size 1) is non-sense
@@ -207,62 +381,191 @@ def count_path_from_nodes_pairs(t, nodes_pairs):
                     flattend_nodes += [n for n in nodes]
 
             for an in flattend_nodes:
-                path = get_path(t, fn, an)
+                path = paths.get(an)
                 if path:
                     c[path] += 1
 
     return c
 
-def path_freq(data_dir):
+def _file_signature(path):
+    st = os.stat(path)
+    return (os.path.basename(path), st.st_mtime, st.st_size)
+
+def _load_checkpoint(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+
+def index_annotations(data_dir, checkpoint_dir = None, loaded = None):
     """
-    Collect the path frequency from the data under directory `data_dir`
+    Map the sentence ids to the paths of their annotation files(*.ann) under `data_dir`
+
+    With `checkpoint_dir`, the sentence id of each file is kept there with the file mtime and size,
+    and only the new or changed files are unpickled again
+    loaded: dict filled with path -> annotation of the files unpickled, so that they are not unpickled again
 
-    >>> path_freq('test_data/parse_and_annotations/')
-    Counter({(u'dobj',): 1, (u'prep_of',): 1})
+    >>> loaded = {}
+    >>> index_annotations('test_data/parse_and_annotations/', loaded = loaded)
+    {'1278417': ['test_data/parse_and_annotations/2018574.ann', 'test_data/parse_and_annotations/2018576.ann', 'test_data/parse_and_annotations/2018577.ann']}
+    >>> len(loaded)
+    3
     """
-    from annotation import (parse_fulltext, align_annotation_with_sentence)
-    from dependency_output_parser import parse_output
-    
-    path_freq = Counter()
-    # load the sentences
-
-    sents = {}
-    for sent_path in Path(data_dir).glob('*.txt'):
-        sent_str = sent_path.open(encoding='utf8').read().strip()
-        sents[sent_path.stem] = sent_str
-
-    # load and parse the annotations 
-    depparses = {}
-    for parse_path in Path(data_dir).glob('*.txt.out'):
-        sent_id = parse_path.stem.split('.')[0]
-        o = parse_output(parse_path.open(encoding='utf8'))
-        if len(o) > 1:
-            sys.stderr.write('Dropping sentence %s as it contains more than one sentences\n' %(parse_path))
-            del sents[sent_id]
-            continue
-        tree = to_graph(o[0].nodes, o[0].edges)
-        depparses[sent_id] = tree
-
-    assert set(sents.keys()) == set(depparses.keys())
-    
-    # collect the path frequency
-    for ann_path in Path(data_dir).glob('*.ann'):
-        ann = pickle.load(ann_path.open('r'))
-        if ann.sent_id not in sents:
-            sys.stderr.write('Dropping annotation %s as it contains more than one sentences\n' %(ann.id))
-            continue
-        sent = sents[ann.sent_id]
-        t = depparses[ann.sent_id]
-        
-        new_sent = ' '.join(t.tokens())
+    index_path = os.path.join(checkpoint_dir, 'ann_index.pkl') if checkpoint_dir else None
+    old_index = (_load_checkpoint(index_path) if index_path else None) or {}
+
+    index = {} # file name -> (signature, sent_id)
+    sent2anns = {}
+    for ann_path in sorted(str(p) for p in Path(data_dir).glob('*.ann')):
+        signature = _file_signature(ann_path)
+        name = signature[0]
+        if name in old_index and old_index[name][0] == signature:
+            sent_id = old_index[name][1]
+        else:
+            with open(ann_path, 'r') as f:
+                ann = pickle.load(f)
+            sent_id = ann.sent_id
+            if loaded is not None:
+                loaded[ann_path] = ann
+        index[name] = (signature, sent_id)
+        sent2anns.setdefault(sent_id, []).append(ann_path)
+
+    if index_path and index != old_index:
+        pickle_atomic(index, index_path)
+    return sent2anns
+
+def sentence_path_freq(sent_path, parse_path, ann_paths, use_cache = True, anns = None):
+    """
+    The path frequency of one sentence: its text, its dependency parse output and its annotation files
+
+    anns: dict of the annotations of `ann_paths` already loaded, by path(see `index_annotations`), the others are unpickled
+    The parse output is loaded by `dependency_cache.load_output`, from its binary cache if `use_cache` and the cache is fresh.
+    Return None if the parse output contains more than one sentence
+    """
+    from dependency_cache import load_output
+
+    with codecs.open(sent_path, 'r', 'utf8') as f:
+        sent = f.read().strip()
+    o = load_output(parse_path, use_cache)
+    if len(o) > 1:
+        return None
+    t = to_tree(o[0].nodes, o[0].edges)
+    new_sent = ' '.join(t.tokens())
+
+    c = Counter()
+    for ann_path in ann_paths:
+        if anns and ann_path in anns:
+            ann = anns[ann_path]
+        else:
+            with open(ann_path, 'r') as f:
+                ann = pickle.load(f)
         aligned_annotations = align_annotation_with_sentence(sent, new_sent, [ann])
         nodes_pairs = get_annotation_nodes(aligned_annotations, t)
-        path_freq += count_path_from_nodes_pairs(t, nodes_pairs)
+        c += count_path_from_nodes_pairs(t, nodes_pairs)
+    return c
+
+def _sentence_path_freq_worker(args):
+    sent_id, signature, sent_path, parse_path, ann_paths, use_cache, anns = args
+    return sent_id, signature, sentence_path_freq(sent_path, parse_path, ann_paths, use_cache, anns)
+
+def path_freq(data_dir, n_jobs = 1, checkpoint_dir = None, use_cache = True):
+    """
+    Collect the path frequency from the data under directory `data_dir`,
+    the up and down paths of `count_path_from_nodes_pairs` from the frame nodes to the annotation nodes
+
+    Each sentence(`sent_id`.txt, its parse `sent_id`.txt.out, or in CoNLL format `sent_id`.txt.conll(any of `dependency_cache.CONLL_EXTENSIONS`),
+    and the *.ann files of it) is counted separately, by a pool of `n_jobs` processes if `n_jobs` > 1.
+    If `use_cache`, the parses are read from and written to their binary caches(see `dependency_cache`).
+    With `checkpoint_dir`, the count of each sentence is saved there together with the mtime and size of its files,
+    and on the next run only the sentences with new or changed files are counted again.
+
+    >>> import shutil, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> data_dir = os.path.join(tmp_dir, 'data') # the parse caches are written next to the parses
+    >>> shutil.copytree('test_data/parse_and_annotations/', data_dir)
+    >>> path_freq(data_dir, use_cache = False)
+    Counter({(u'amod', 'u'): 1, (u'dobj', 'd'): 1, (u'prep_of', 'd'): 1, (u'prt', 'u', u'dobj', 'd'): 1})
+    >>> os.listdir(data_dir) == os.listdir('test_data/parse_and_annotations/')
+    True
+
+    >>> checkpoint_dir = os.path.join(tmp_dir, 'checkpoints')
+    >>> path_freq(data_dir, n_jobs = 2, checkpoint_dir = checkpoint_dir)
+    Counter({(u'amod', 'u'): 1, (u'dobj', 'd'): 1, (u'prep_of', 'd'): 1, (u'prt', 'u', u'dobj', 'd'): 1})
+    >>> path_freq(data_dir, checkpoint_dir = checkpoint_dir) # from the checkpoints
+    Counter({(u'amod', 'u'): 1, (u'dobj', 'd'): 1, (u'prep_of', 'd'): 1, (u'prt', 'u', u'dobj', 'd'): 1})
+    >>> os.remove(os.path.join(checkpoint_dir, '1278417.pkl'))
+    >>> path_freq(data_dir, checkpoint_dir = checkpoint_dir) # from the parse cache
+    Counter({(u'amod', 'u'): 1, (u'dobj', 'd'): 1, (u'prep_of', 'd'): 1, (u'prt', 'u', u'dobj', 'd'): 1})
+
+    >>> open(os.path.join(data_dir, '1278417.txt.conll'), 'w').close()
+    >>> path_freq(data_dir) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: Sentence 1278417 has two parses: ...
+    >>> shutil.rmtree(tmp_dir)
+    """
+    if checkpoint_dir and not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    sent_paths = dict((p.stem, str(p)) for p in Path(data_dir).glob('*.txt'))
+    from dependency_cache import CONLL_EXTENSIONS
+    parse_paths = {}
+    for suffix in ['.txt.out'] + ['.txt' + ext for ext in CONLL_EXTENSIONS]:
+        for p in Path(data_dir).glob('*' + suffix):
+            sent_id = p.name[:-len(suffix)]
+            if sent_id in parse_paths:
+                raise ValueError("Sentence %s has two parses: %s and %s" %(sent_id, parse_paths[sent_id], p))
+            parse_paths[sent_id] = str(p)
+    assert set(sent_paths.keys()) == set(parse_paths.keys())
+    loaded = {} # the annotations unpickled by the indexing
+    sent2anns = index_annotations(data_dir, checkpoint_dir, loaded)
+
+    for sent_id in set(sent2anns.keys()) - set(sent_paths.keys()):
+        for ann_path in sent2anns.pop(sent_id):
+            sys.stderr.write('Dropping annotation %s as its sentence %s is missing\n' %(ann_path, sent_id))
+
+    freq = Counter()
+    tasks = []
+    for sent_id in sorted(sent_paths):
+        ann_paths = sent2anns.get(sent_id, [])
+        # the path kind is part of it, the checkpoints of the downward only counts are not reused
+        signature = ('paths_from', ) + tuple(_file_signature(p) for p in [sent_paths[sent_id], parse_paths[sent_id]] + ann_paths)
+        if checkpoint_dir:
+            checkpoint = _load_checkpoint(os.path.join(checkpoint_dir, sent_id + '.pkl'))
+            if checkpoint is not None and checkpoint[0] == signature:
+                if checkpoint[1] is not None:
+                    freq.update(checkpoint[1])
+                continue
+        anns = dict((p, loaded.pop(p)) for p in ann_paths if p in loaded)
+        tasks.append((sent_id, signature, sent_paths[sent_id], parse_paths[sent_id], ann_paths, use_cache, anns))
+    loaded.clear() # those of the sentences counted from the checkpoints
+
+    if n_jobs > 1 and len(tasks) > 0:
+        pool = Pool(n_jobs)
+        # a few chunks of tasks per process rather than one round trip per sentence
+        results = pool.imap_unordered(_sentence_path_freq_worker, tasks,
+                                      chunksize = max(1, len(tasks) // (n_jobs * 4)))
+    else:
+        pool = None
+        results = (_sentence_path_freq_worker(task) for task in tasks)
+    try:
+        for sent_id, signature, c in results:
+            if c is None:
+                sys.stderr.write('Dropping sentence %s as it contains more than one sentences\n' %(parse_paths[sent_id]))
+            else:
+                freq.update(c)
+            if checkpoint_dir:
+                pickle_atomic((signature, c), os.path.join(checkpoint_dir, sent_id + '.pkl'))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    return path_freq
+    return freq
 
 if __name__ == "__main__":
-    freq = path_freq('data/frame_identification')
-    import pdb
-    pdb.set_trace()
+    freq = path_freq('data/frame_identification', n_jobs = 4, checkpoint_dir = 'dump/path_freq')
+    for path, count in freq.most_common():
+        print '%d\t%s' %(count, ' '.join(path))
 
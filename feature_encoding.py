@@ -1,14 +1,25 @@
-from scipy.sparse import (lil_matrix, csr_matrix)
-from collections import defaultdict
+import zlib
+from array import array
+from itertools import islice
+from collections import (defaultdict, deque)
+from multiprocessing import Pool
 
-def encode(data_features, features):
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from feature_template import TemplatedColumns
+from vocabulary import Vocabulary
+
+def encode(data_features, features, dtype = 'i', n_jobs = 1, shard_size = 100000):
     """
-    data_features: list of dict of feature values
-    features: the selected features
+    data_features: list(or any iterable) of dict of feature values, or `feature_template.TemplatedColumns`
+    features: the selected features, or a `vocabulary.Vocabulary` to encode with its columns
+    dtype: dtype of the matrix entries, as they are indicators, np.int8 is the most compact
+    n_jobs: number of processes encoding shards of `shard_size` rows
 
     Return:
-    1. scipy.sparse.lil_matrix(2d) of the encoded data
-    2. feature_value to column index mapping
+    1. scipy.sparse.csr_matrix(2d) of the encoded data, with 32-bit indices
+    2. feature_value to column index mapping(the vocabulary itself if given)
 
     >>> data_features = [{'a': 1, 'b': 1}, {'a': 2, 'b': 2}, {'a': 3, 'b': 3}]
     >>> features = {'a': set([1, 2]), 'b': set([1])}
@@ -19,23 +30,199 @@ def encode(data_features, features):
       (1, 1)	1
     >>> mapping
     defaultdict(<type 'dict'>, {'a': {1: 0, 2: 1}, 'b': {1: 2}})
+    >>> data.shape, data.dtype, data.indices.dtype
+    ((3, 3), dtype('int32'), dtype('int32'))
+    >>> data2, _ = encode(iter(data_features), features, n_jobs = 2, shard_size = 2)
+    >>> (data2 != data).nnz
+    0
+
+    >>> from feature_template import (apply_templates, apply_templates_columnar)
+    >>> templates, templated_features = [('a',), ('b',)], {('a',): set([(1,), (2,)]), ('b',): set([(1,)])}
+    >>> data3, _ = encode(apply_templates_columnar(data_features, templates), templated_features)
+    >>> data4, _ = encode(apply_templates(data_features, templates), templated_features)
+    >>> (data3 != data4).nnz, data3.nnz
+    (0, 3)
+    """
+    if isinstance(features, Vocabulary):
+        mapping, acc = features, features.n_features
+    else:
+        acc = 0
+        mapping = defaultdict(dict)
+        for name, values in features.items():
+            for value in values:
+                mapping[name][value] = acc
+                acc+=1
+
+    if isinstance(data_features, TemplatedColumns):
+        return _encode_columns(data_features, mapping, acc, dtype), mapping
+
+    if n_jobs == 1:
+        indices, indptr = _encode_rows(data_features, mapping)
+    else:
+        indices, indptr = array('i'), array('i', [0])
+
+        def collect(result):
+            shard_indices, shard_indptr = result
+            offset = indptr[-1]
+            indptr.extend(p + offset for p in shard_indptr[1:])
+            indices.extend(shard_indices)
+
+        rows = iter(data_features)
+        pool = Pool(n_jobs, initializer = _init_shard_worker, initargs = (mapping, ))
+        try:
+            # keep a bounded number of shards in flight, so that a stream is not read ahead into memory
+            pending = deque()
+            while True:
+                shard = list(islice(rows, shard_size))
+                if len(shard) == 0:
+                    break
+                pending.append(pool.apply_async(_encode_shard, (shard, )))
+                if len(pending) >= 2 * n_jobs:
+                    collect(pending.popleft().get())
+            while pending:
+                collect(pending.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+
+    indices = np.frombuffer(indices, dtype = np.int32)
+    indptr = np.frombuffer(indptr, dtype = np.int32)
+    data = np.ones(len(indices), dtype = dtype) # indicator variable
+    return csr_matrix((data, indices, indptr), shape = (len(indptr) - 1, acc)), mapping
+
+def _encode_rows(data_features, mapping):
+    """
+    The CSR `indices` and `indptr` of the rows, column indices sorted within a row
+    """
+    indices = array('i')
+    indptr = array('i', [0])
+    for features in data_features:
+        columns = []
+        for key, value in features.items():
+            values = mapping.get(key)
+            if values is not None:
+                column = values.get(value)
+                if column is not None:
+                    columns.append(column)
+        columns.sort()
+        indices.extend(columns)
+        indptr.append(len(indices))
+    return indices, indptr
+
+def _encode_columns(templated_columns, mapping, n_columns, dtype):
+    """
+    Encode `feature_template.TemplatedColumns` by translating each template's value ids to matrix columns
+    """
+    n_rows = len(templated_columns)
+    columns = np.empty((n_rows, len(templated_columns.templates)), dtype = np.int32)
+    for j, (template, column, values) in enumerate(zip(templated_columns.templates, templated_columns.columns, templated_columns.values)):
+        template_mapping = mapping.get(template, {})
+        id_to_column = np.array([template_mapping.get(value, -1) for value in values] or [-1], dtype = np.int32)
+        columns[:, j] = id_to_column[column]
+
+    # unselected values(-1) are sorted to the front of each row
+    columns.sort(axis = 1)
+    selected = columns >= 0
+    indices = columns[selected]
+    indptr = np.zeros(n_rows + 1, dtype = np.int32)
+    np.cumsum(selected.sum(axis = 1), out = indptr[1:])
+    data = np.ones(len(indices), dtype = dtype) # indicator variable
+    return csr_matrix((data, indices, indptr), shape = (n_rows, n_columns))
+
+_shard_mapping = None
+
+def _init_shard_worker(mapping):
+    global _shard_mapping
+    _shard_mapping = mapping
+
+def _encode_shard(shard):
+    return _encode_rows(shard, _shard_mapping)
+
+
+def canonical_bytes(obj):
+    """
+    Byte string representing `obj`(strings, numbers and tuples of them), the same for str and unicode
+
+    >>> canonical_bytes(('head_stem', 'frame'))
+    "('head_stem','frame')"
+    >>> canonical_bytes((u'NP', 'u', 'S')) == canonical_bytes(('NP', u'u', 'S'))
+    True
+    """
+    if isinstance(obj, unicode):
+        return repr(obj.encode('utf8'))
+    elif isinstance(obj, (tuple, list)):
+        return '(' + ','.join(canonical_bytes(o) for o in obj) + ')'
+    else:
+        return repr(obj)
+
+def stable_hash(name, value, seed = 0):
+    """
+    32-bit hash of the templated feature (name, value), the same across processes, runs and machines
+
+    >>> stable_hash(('phrase_type',), (u'NP',)) == stable_hash(('phrase_type',), ('NP',))
+    True
+    >>> stable_hash(('phrase_type',), ('NP',)) == stable_hash(('phrase_type',), ('NP',), seed = 1)
+    False
+    """
+    return zlib.crc32(canonical_bytes(name) + '=' + canonical_bytes(value), seed) & 0xffffffff
+
+def hash_column(name, value, n_features):
     """
-    acc = 0
-    mapping = defaultdict(dict)
-    for name, values in features.items():
-        for value in values:
-            mapping[name][value] = acc
-            acc+=1
+    Column of (name, value) in the matrix of `hash_encode`, for encoding at inference time
+    """
+    return stable_hash(name, value) % n_features
+
+def hash_encode(data_features, n_features, dtype = 'i', report_collisions = False):
+    """
+    Encode by feature hashing: (name, value) goes to column `hash_column(name, value, n_features)`.
+    No feature selection or mapping is needed, at the cost of collisions.
+
+    data_features: list(or any iterable) of dict of feature values
+    n_features: number of columns
+    report_collisions: whether to count the collisions, which keeps a 64-bit fingerprint per distinct (name, value)
+
+    Return:
+    1. scipy.sparse.csr_matrix(2d) of the encoded data
+    2. None, or if `report_collisions`, dict of the number of distinct (name, value) `n_keys`,
+       the number of columns they fall in `n_columns_used` and the fraction of keys lost in collisions `collision_rate`
+
+    >>> data_features = [{'a': 1, 'b': 1}, {'a': 2, 'b': 2}, {'a': 3, 'b': 1}]
+    >>> data, stats = hash_encode(data_features, 2 ** 20, report_collisions = True)
+    >>> data.shape, data.nnz
+    ((3, 1048576), 6)
+    >>> data[0, hash_column('b', 1, 2 ** 20)]
+    1
+    >>> sorted(stats.items())
+    [('collision_rate', 0.0), ('n_columns_used', 5), ('n_keys', 5)]
+    >>> _, stats = hash_encode(data_features, 1, report_collisions = True)
+    >>> stats['collision_rate']
+    0.8
+    """
+    fingerprints = set() if report_collisions else None
+    columns_used = set() if report_collisions else None
 
-    data = lil_matrix((len(data_features), acc), dtype='i') # indicator variable, so to integer
-    for i, features in enumerate(data_features):
+    indices = array('i')
+    indptr = array('i', [0])
+    for features in data_features:
+        columns = set()
         for key, value in features.items():
-            if key in mapping and value in mapping[key]:
-                data[i,mapping[key][value]] = 1
-
-    # for row, features in zip(data, data_features):
-    #     for key, value in features.items():
-    #         if key in mapping and value in mapping[key]:
-    #             row[mapping[key][value]] = 1
-    return csr_matrix(data), mapping
-    
+            h = stable_hash(key, value)
+            columns.add(h % n_features)
+            if report_collisions:
+                fingerprints.add((h << 32) | stable_hash(key, value, seed = 1))
+        indices.extend(sorted(columns))
+        indptr.append(len(indices))
+        if report_collisions:
+            columns_used.update(columns)
+
+    indices = np.frombuffer(indices, dtype = np.int32)
+    indptr = np.frombuffer(indptr, dtype = np.int32)
+    data = np.ones(len(indices), dtype = dtype) # indicator variable
+    matrix = csr_matrix((data, indices, indptr), shape = (len(indptr) - 1, n_features))
+
+    if not report_collisions:
+        return matrix, None
+    n_keys = len(fingerprints)
+    return matrix, {'n_keys': n_keys,
+                    'n_columns_used': len(columns_used),
+                    'collision_rate': 1 - float(len(columns_used)) / n_keys if n_keys > 0 else 0.}
@@ -1,20 +1,59 @@
 
+from features import (NODE_SCOPE, FRAME_SCOPE, NODE_FRAME_SCOPE)
+
+
 class FeatureExtractor(object):
     """
     feature_funcs: feature object from `features`. They are the features to extract
+
+    If the context carries a memo, values of node-scoped features are computed once per node
+    and values of frame-scoped features once per frame(see `features.Feature.scope`)
     
     >>> from features import (FooFeature, BarFeature)
     >>> ext = FeatureExtractor([FooFeature, BarFeature])
     >>> ext.extract('a', None)
     {'foo': 'foo', 'bar': 'bar'}
+
+    >>> from nltk.tree import Tree
+    >>> from basic_struct import (Context, Frame, NodePosition)
+    >>> from features import (PhraseType, Frame as FrameFeature)
+    >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])])])
+    >>> ext = FeatureExtractor([PhraseType, FrameFeature])
+    >>> memo = {}
+    >>> ext.extract(tree[0][0], Context(None, tree, Frame(2, 5, 'Experiencer_focus'), NodePosition(0, 0), None, memo))
+    {'phrase_type': 'NP', 'frame': 'Experiencer_focus'}
+    >>> len(memo) # one node-scoped and one frame-scoped value
+    2
+    >>> ext.extract(tree[0][1][1], Context(None, tree, Frame(2, 5, 'Experiencer_focus'), NodePosition(7, 9), None, memo))
+    {'phrase_type': 'NP', 'frame': 'Experiencer_focus'}
+    >>> len(memo) # the frame value is reused
+    3
     """
     def __init__(self, feature_funcs):
         self.feature_funcs = feature_funcs
+        self.scopes = [getattr(f, 'scope', NODE_FRAME_SCOPE) for f in feature_funcs]
 
     def extract(self, unit, context):
         """
         unit: a parse tree node
         context: the context information about the node
         """
-        return {f.name: f.get_value(unit, context)
-                for f in self.feature_funcs}
+        if context is None or context.memo is None:
+            return {f.name: f.get_value(unit, context)
+                    for f in self.feature_funcs}
+
+        memo = context.memo
+        values = {}
+        for f, scope in zip(self.feature_funcs, self.scopes):
+            if scope == NODE_SCOPE:
+                key = ('extracted', f.name, 'node', id(unit))
+            elif scope == FRAME_SCOPE:
+                key = ('extracted', f.name, context.frame)
+            else:
+                values[f.name] = f.get_value(unit, context)
+                continue
+
+            if key not in memo:
+                memo[key] = f.get_value(unit, context)
+            values[f.name] = memo[key]
+        return values
@@ -1,27 +1,172 @@
+from itertools import islice
 from collections import (Counter, defaultdict)
 
+import numpy as np
 
-def filter_by_frequency(templated_features, cutoff):
+from feature_encoding import stable_hash
+from feature_template import TemplatedColumns
+
+
+def filter_by_frequency(templated_features, cutoff, sketch = None):
     """
-    templated_features: list of dict containing templated feature values
+    templated_features: list of dict containing templated feature values, or `feature_template.TemplatedColumns`
     cutoff: some minimal frequency cutoff
-    
+    sketch: `CountMinSketch` of `templated_features`. If given, only the values whose estimated frequency
+            reaches `cutoff` are counted, which gives the same result in much less memory
+
     >>> templated_features = [{('a',): (1,), ('b',): (2,)}, {('a',): (1,), ('b',): (1,)}]
     >>> filter_by_frequency(templated_features, 2)
     defaultdict(<type 'set'>, {('a',): set([(1,)])})
+    >>> sketch = CountMinSketch(width = 16, depth = 2)
+    >>> sketch.update(templated_features)
+    >>> filter_by_frequency(templated_features, 2, sketch)
+    defaultdict(<type 'set'>, {('a',): set([(1,)])})
+
+    >>> from feature_template import apply_templates_columnar
+    >>> filter_by_frequency(apply_templates_columnar([{'a': 1, 'b': 2}, {'a': 1, 'b': 1}], [('a',), ('b',)]), 2)
+    defaultdict(<type 'set'>, {('a',): set([(1,)])})
+    """
+    if isinstance(templated_features, TemplatedColumns):
+        return select_columns(templated_features, cutoff)
+    elif sketch is None:
+        table = count_features(templated_features)
+    else:
+        table = sketch.count_candidates(templated_features, cutoff)
+    return select_features(table, cutoff)
+
+def count_features(templated_features):
+    """
+    The frequency table: feature name -> Counter of the values
+
+    Tables of shards of the data(e.g. one per file or worker) can be combined by `merge_counts`
     """
-    table = defaultdict(lambda: Counter())
+    table = defaultdict(Counter)
 
     for features in templated_features:
         for feature_name, feature_value in features.items():
             table[feature_name][feature_value] += 1
-            
-      
+
+    return table
+
+def merge_counts(tables):
+    """
+    Sum up the frequency tables from `count_features`
+
+    >>> t1 = count_features([{'a': 1, 'b': 2}])
+    >>> t2 = count_features([{'a': 1, 'b': 3}])
+    >>> merge_counts([t1, t2]) == count_features([{'a': 1, 'b': 2}, {'a': 1, 'b': 3}])
+    True
+    """
+    merged = defaultdict(Counter)
+    for table in tables:
+        for feature_name, counter in table.items():
+            merged[feature_name].update(counter)
+    return merged
+
+def select_features(table, cutoff):
+    """
+    The values whose frequency in `table` reaches `cutoff`
+    """
     selected_features = defaultdict(set)
-    
+
     for feature_name in table:
         for feature_value, freq in table[feature_name].items():
             if freq >= cutoff:
                 selected_features[feature_name].add(feature_value)
 
     return selected_features
+
+
+def select_columns(templated_columns, cutoff):
+    """
+    `filter_by_frequency` for `feature_template.TemplatedColumns`, counting the value ids of each template
+    """
+    selected_features = defaultdict(set)
+    for template, column, values in zip(templated_columns.templates, templated_columns.columns, templated_columns.values):
+        freqs = np.bincount(column, minlength = len(values))
+        for i in np.flatnonzero(freqs >= cutoff):
+            selected_features[template].add(values[i])
+    return selected_features
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of the templated feature values, in `depth` x `width` counters
+
+    The estimated frequency of a value is never below the true one, so the values whose estimate
+    reaches the cutoff are a superset of the selected ones, and only those need exact counting.
+    Sketches of shards of the data(with the same width, depth and seed) can be combined by `merge`.
+
+    >>> rows = [{'a': 1, 'b': 2}, {'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    >>> sketch = CountMinSketch(width = 1024, depth = 3)
+    >>> sketch.update(rows[:2])
+    >>> other = CountMinSketch(width = 1024, depth = 3)
+    >>> other.update(rows[2:])
+    >>> sketch.merge(other)
+    >>> sketch.estimate('a', 1) >= 2, sketch.estimate('b', 3) >= 2
+    (True, True)
+    >>> dict(sketch.count_candidates(rows, 2)) == {'a': Counter({1: 2}), 'b': Counter({3: 2})}
+    True
+    """
+    # modulus of the hash family, a Mersenne prime
+    prime = 2 ** 31 - 1
+
+    def __init__(self, width = 2 ** 22, depth = 4, seed = 0, chunk_size = 10000):
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.counts = np.zeros((depth, width), dtype = np.int32)
+
+        # one (a, b) of the hash family per row
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, self.prime, size = depth).astype(np.int64)
+        self.b = rng.randint(0, self.prime, size = depth).astype(np.int64)
+
+    def _columns(self, hashes):
+        """
+        depth x len(hashes) array of the counter columns
+        """
+        hashes = np.asarray(hashes, dtype = np.int64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % self.prime) % self.width
+
+    def _chunks(self, templated_features):
+        """
+        Yield the (name, value) pairs and their hashes, `chunk_size` rows at a time
+        """
+        rows = iter(templated_features)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if len(chunk) == 0:
+                break
+            keys = [key for features in chunk for key in features.items()]
+            yield keys, [stable_hash(name, value) for name, value in keys]
+
+    def update(self, templated_features):
+        for _, hashes in self._chunks(templated_features):
+            columns = self._columns(hashes)
+            for d in xrange(self.depth):
+                # the distinct columns of the chunk only, not the whole width
+                used, counts = np.unique(columns[d], return_counts = True)
+                self.counts[d, used] += counts.astype(np.int32)
+
+    def merge(self, other):
+        assert (self.width, self.depth, self.seed) == (other.width, other.depth, other.seed), "Incompatible sketches"
+        self.counts += other.counts
+
+    def estimate(self, name, value):
+        columns = self._columns([stable_hash(name, value)])[:, 0]
+        return self.counts[np.arange(self.depth), columns].min()
+
+    def count_candidates(self, templated_features, cutoff):
+        """
+        Exact frequency table(as in `count_features`) of the values whose estimated frequency reaches `cutoff`
+        """
+        table = defaultdict(Counter)
+        rows = np.arange(self.depth)[:, None]
+        for keys, hashes in self._chunks(templated_features):
+            estimates = self.counts[rows, self._columns(hashes)].min(axis = 0)
+            for i in np.flatnonzero(estimates >= cutoff):
+                feature_name, feature_value = keys[i]
+                table[feature_name][feature_value] += 1
+        return table
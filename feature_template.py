@@ -1,3 +1,7 @@
+from array import array
+
+import numpy as np
+
 def apply_templates(data_features, templates):
     """
     >>> templates = [\
@@ -9,11 +13,112 @@ def apply_templates(data_features, templates):
     >>> apply_templates(data_features, templates) # doctest: +NORMALIZE_WHITESPACE
     [{('p', 't', 'f'): (1, 2, 0), ('t', 'f'): (2, 0), ('h', 'f'): (0, 0)}, {('p', 't', 'f'): (2, 1, 0), ('t', 'f'): (1, 0), ('h', 'f'): (1, 0)}, {('p', 't', 'f'): (0, 1, 1), ('t', 'f'): (1, 1), ('h', 'f'): (0, 1)}]
     """
-    all_rows = []
+    return list(iter_templates(data_features, templates))
+
+def iter_templates(data_features, templates):
+    """
+    Generator version of `apply_templates`, `data_features` can be any iterable
+
+    >>> rows = iter_templates(iter([{'h': 0, 'f': 1}]), [('h', 'f')])
+    >>> rows.next()
+    {('h', 'f'): (0, 1)}
+    """
     for features in data_features:
         row = {}
         for template in templates:
             row[template] = tuple([features[key] for key in template])
-        all_rows.append(row)
+        yield row
+
+
+class TemplatedColumns(object):
+    """
+    Templated feature values of many rows, stored column-wise as integer ids(see `apply_templates_columnar`)
+
+    templates: the templates
+    columns: for each template, int32 array of the templated value id of every row
+    values: for each template, list of the templated values indexed by id
+    """
+    def __init__(self, templates, columns, values):
+        self.templates = templates
+        self.columns = columns
+        self.values = values
+
+    def __len__(self):
+        return len(self.columns[0]) if len(self.columns) > 0 else 0
+
+    def rows(self):
+        """
+        The rows as dicts, in the format of `apply_templates`
+        """
+        for i in xrange(len(self)):
+            yield {template: values[column[i]]
+                   for template, column, values in zip(self.templates, self.columns, self.values)}
+
+def compile_templates(templates):
+    """
+    The base feature names used by `templates` and each template as positions in those names
+
+    >>> compile_templates([('h', 'f'), ('p', 't', 'f'), ('t', 'f')])
+    (['h', 'f', 'p', 't'], [(0, 1), (2, 3, 1), (3, 1)])
+    """
+    names = []
+    for template in templates:
+        for key in template:
+            if key not in names:
+                names.append(key)
+    return names, [tuple([names.index(key) for key in template]) for template in templates]
+
+def apply_templates_columnar(data_features, templates):
+    """
+    Same as `apply_templates`, but the result is a `TemplatedColumns`:
+    base feature values are interned to integer ids once, each template combines the ids
+    and no dict is created per row. `data_features` can be any iterable
+
+    >>> templates = [('h', 'f'), ('p', 't', 'f'), ('t', 'f')]
+    >>> data_features = [{'h': 0, 'f': 0, 'p': 1, 't': 2}, {'h': 1, 'f': 0, 'p': 2, 't': 1}, {'h': 0, 'f': 1, 'p': 0, 't': 1}]
+    >>> columns = apply_templates_columnar(iter(data_features), templates)
+    >>> len(columns)
+    3
+    >>> columns.columns[0]
+    array([0, 1, 2], dtype=int32)
+    >>> columns.values[2]
+    [(2, 0), (1, 0), (1, 1)]
+    >>> list(columns.rows()) == apply_templates(data_features, templates)
+    True
+    """
+    names, compiled = compile_templates(templates)
+
+    # per base feature: value -> id and id -> value
+    base_ids = [{} for _ in names]
+    base_values = [[] for _ in names]
+    # per template: tuple of base ids -> templated id
+    template_ids = [{} for _ in templates]
+    columns = [array('i') for _ in templates]
+
+    for features in data_features:
+        ids = []
+        for name, value_ids, values in zip(names, base_ids, base_values):
+            value = features[name]
+            i = value_ids.get(value)
+            if i is None:
+                i = value_ids[value] = len(values)
+                values.append(value)
+            ids.append(i)
+
+        for positions, key_ids, column in zip(compiled, template_ids, columns):
+            key = tuple([ids[p] for p in positions])
+            i = key_ids.get(key)
+            if i is None:
+                i = key_ids[key] = len(key_ids)
+            column.append(i)
+
+    values = []
+    for positions, key_ids in zip(compiled, template_ids):
+        template_values = [None] * len(key_ids)
+        for key, i in key_ids.items():
+            template_values[i] = tuple([base_values[p][j] for p, j in zip(positions, key)])
+        values.append(template_values)
 
-    return all_rows        
+    return TemplatedColumns(templates,
+                            [np.frombuffer(column, dtype = np.int32) for column in columns],
+                            values)
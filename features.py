@@ -1,12 +1,20 @@
 from nltk.stem import PorterStemmer
 
-from ling_util import get_head_word
+from ling_util import (get_head_word, get_head_words)
 
 
 class FeatureExtractionFail(Exception):
     pass
 
+# What the value of a feature depends on.
+# `FeatureExtractor` computes node-scoped values once per node and frame-scoped values once per frame in a sentence
+NODE_SCOPE = 'node'
+FRAME_SCOPE = 'frame'
+NODE_FRAME_SCOPE = 'node_frame'
+
 class Feature(object):
+    scope = NODE_FRAME_SCOPE
+
     @classmethod
     def get_value(cls, unit, context):
         raise NotImplementedError
@@ -63,6 +71,18 @@ class PathToFrame(Feature):
     ('PRP$', 'u', 'NP', 'u', 'NP')
     >>> PathToFrame.get_value(tree[0][0], Context(sent, tree, Frame(start=0, end=3, name=''), NodePosition(0, 28))) # node is the parent
     ('NP', 'd', 'NP', 'd', 'PRP$')
+    >>> from tree_util import SpanIndex
+    >>> PathToFrame.get_value(tree[0][1][0], Context(sent, tree, Frame(start=5, end=16, name='Giving'), NodePosition(18, 19), SpanIndex(tree))) # to
+    ('TO', 'u', 'PP', 'u', 'NP', 'd', 'NP', 'd', 'NN')
+
+    # with the memo, paths of all the nodes to the frame are computed at once
+    >>> index, memo = SpanIndex(tree), {}
+    >>> PathToFrame.get_value(tree[0][0][1][0], Context(sent, tree, Frame(start=5, end=16, name='Giving'), NodePosition(18, 19), index, memo)) # to
+    ('TO', 'u', 'PP', 'u', 'NP', 'd', 'NP', 'd', 'NN')
+    >>> len(memo[('path_to_frame', Frame(start=5, end=16, name='Giving'))]) == len(index.nodes)
+    True
+    >>> PathToFrame.get_value(tree[0][0], Context(sent, tree, Frame(start=0, end=3, name=''), NodePosition(0, 28), index, memo)) # node is the parent
+    ('NP', 'd', 'NP', 'd', 'PRP$')
     """
     name = 'path_to_frame'
 
@@ -82,18 +102,81 @@ class PathToFrame(Feature):
         if start == None or end == None:
             raise FeatureExtractionFail('Cannot extract the path at %r for "%s"' %((char_start, char_end), sent))
         return start, end
+
+    @classmethod
+    def get_tree_position(cls, c, char_start, char_end):
+        """Tree position of the lowest node spanning the char range, using the span index of the context if any"""
+        if c.span_index is None:
+            start, end = cls.get_word_index_range(c.sentence, char_start, char_end)
+            return c.parse_tree.treeposition_spanning_leaves(start, end)
+
+        word_range = c.span_index.word_range(char_start, char_end)
+        if word_range is None:
+            raise FeatureExtractionFail('Cannot extract the path at %r for "%s"' %((char_start, char_end), c.sentence))
+        return c.span_index.treeposition_spanning_words(*word_range)
     
+    @classmethod
+    def get_values(cls, c):
+        """
+        The paths from all the nodes of the span index of `c` to the frame of `c`, keyed by id(node)
+
+        The frame side(its tree position and the labels down to it) is computed once,
+        each node walks up its parents to the lowest common ancestor
+        """
+        index = c.span_index
+        path2 = cls.get_tree_position(c, c.frame.start, c.frame.end)
+        # labels from the root down to the frame, the leaf excluded
+        down_labels = [index.node_at[path2[:k]].label() for k in xrange(len(path2))]
+
+        paths = {}
+        for u, _ in index.nodes:
+            path1 = index.treeposition_spanning_words(*index.word_spans[id(u)])
+            if path1 == path2:
+                paths[id(u)] = (u.label(),)
+                continue
+
+            # depth of the lowest common ancestor
+            i = 0
+            max_steps = min(len(path1), len(path2))
+            while i < max_steps and path1[i] == path2[i]:
+                i += 1
+
+            # source node up to LCA, the leaf excluded
+            steps = []
+            node = index.node_at[path1[:-1]]
+            for _ in xrange(len(path1) - 1 - i):
+                steps.append(node.label())
+                steps.append('u')
+                node = index.parents[id(node)]
+
+            if i < len(path2):
+                steps.append(down_labels[i])
+            else:
+                steps.append(index.node_at[path2].label())
+
+            # LCA down to frame node
+            for label in down_labels[i+1:]:
+                steps.append('d')
+                steps.append(label)
+
+            paths[id(u)] = tuple(steps)
+        return paths
+
     @classmethod
     def get_value(cls, u, c):
+        if c.memo is not None and c.span_index is not None:
+            key = (cls.name, c.frame)
+            if key not in c.memo:
+                c.memo[key] = cls.get_values(c)
+            return c.memo[key][id(u)]
+
         # print u, c.node_pos.start, c.node_pos.end
         # print c.frame
         #from root to source node
-        start, end = cls.get_word_index_range(c.sentence, c.node_pos.start, c.node_pos.end)
-        path1 = c.parse_tree.treeposition_spanning_leaves(start, end)
+        path1 = cls.get_tree_position(c, c.node_pos.start, c.node_pos.end)
 
         #from root to frame node
-        start, end = cls.get_word_index_range(c.sentence, c.frame.start, c.frame.end)
-        path2 = c.parse_tree.treeposition_spanning_leaves(start, end)
+        path2 = cls.get_tree_position(c, c.frame.start, c.frame.end)
         
         if path1 == path2:
             return (u.label(),)
@@ -131,6 +214,7 @@ class PhraseType(Feature):
     'NP'
     """
     name = "phrase_type"
+    scope = NODE_SCOPE
     
     @classmethod
     def get_value(cls, u, c):
@@ -142,16 +226,45 @@ class HeadWordStem(Feature):
     >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('NP', [Tree('PRP$', ['Your']), Tree('NN', ['contribution'])]), Tree('PP', [Tree('TO', ['to']), Tree('NP', [Tree('NNP', ['Goodwill'])])])]), Tree('VP', [Tree('MD', ['will']), Tree('VP', [Tree('VB', ['mean']), Tree('ADVP', [Tree('ADVP', [Tree('RBR', ['more'])]), Tree('SBAR', [Tree('IN', ['than']), Tree('S', [Tree('NP', [Tree('PRP', ['you'])]), Tree('VP', [Tree('MD', ['may']), Tree('VP', [Tree('VB', ['know'])])])])])])])]), Tree('.', ['.'])])])
     >>> HeadWordStem.get_value(tree[0], None)
     u'will'
+
+    # with the memo, the head words of the whole tree are computed at once
+    >>> from basic_struct import Context
+    >>> from tree_util import SpanIndex
+    >>> c = Context(None, tree, None, None, SpanIndex(tree), {})
+    >>> print HeadWordStem.get_value(tree[0][0][0], c), HeadWordStem.get_value(tree[0][1][1], c)
+    contribut mean
     """
     name = "head_stem"
+    scope = NODE_SCOPE
     stemmer=PorterStemmer()
+
+    # bounded memo of word stems, cleared when full
+    stem_cache_size = 100000
+    _stems = {}
+
+    @classmethod
+    def stem(cls, word):
+        try:
+            return cls._stems[word]
+        except KeyError:
+            stem = cls.stemmer.stem(word)
+            if len(cls._stems) >= cls.stem_cache_size:
+                cls._stems.clear()
+            cls._stems[word] = stem
+            return stem
         
     @classmethod
     def get_value(cls, u, c):
-        head_word = get_head_word(u)
+        if c is not None and c.memo is not None:
+            key = (cls.name, )
+            if key not in c.memo:
+                c.memo[key] = get_head_words(c.parse_tree)
+            head_word = c.memo[key][id(u)]
+        else:
+            head_word = get_head_word(u)
         if head_word == None:
             print u
-        return cls.stemmer.stem(head_word)
+        return cls.stem(head_word)
 
 class Voice(Feature):
     @classmethod
@@ -160,6 +273,8 @@ class Voice(Feature):
 
 class Frame(Feature):
     name = "frame"
+    scope = FRAME_SCOPE
+
     @classmethod
     def get_value(cls, u, c):
         return c.frame.name
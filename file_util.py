@@ -0,0 +1,47 @@
+"""
+File utilities shared by the caches and checkpoints
+"""
+import os
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def write_atomic(path, write):
+    """
+    Call `write` with a temporary file in the directory of `path`, then rename it to `path`,
+    so that readers never see a partial file. The temporary file is removed if `write` fails.
+
+    >>> import shutil
+    >>> d = tempfile.mkdtemp()
+    >>> path = os.path.join(d, 'a.txt')
+    >>> write_atomic(path, lambda f: f.write('done'))
+    >>> open(path).read()
+    'done'
+    >>> def fail(f):
+    ...     f.write('partial')
+    ...     raise IOError('disk full')
+    >>> write_atomic(path, fail)
+    Traceback (most recent call last):
+    ...
+    IOError: disk full
+    >>> open(path).read(), os.listdir(d)
+    ('done', ['a.txt'])
+    >>> shutil.rmtree(d)
+    """
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+def pickle_atomic(obj, path):
+    """
+    Pickle `obj` to `path` by `write_atomic`
+    """
+    write_atomic(path, lambda f: pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,207 @@
+"""
+Semantic role labelling of new sentences with a trained model
+"""
+import os
+import time
+
+import numpy as np
+
+from basic_struct import (Context, Frame, NodePosition)
+from feature_extractor import FeatureExtractor
+from feature_template import iter_templates
+from feature_encoding import (encode, hash_encode, hash_column)
+from tree_util import (SpanIndex, collect_nodes, find_node_by_positions)
+from ling_util import convert_brackets
+from annotation import (Annotation, Target, align_annotation_with_sentence)
+from labels import LabelIndex
+from vocabulary import Vocabulary
+from maxent import MaxEntClassifier
+from dataset import Dataset
+from candidate_pruning import XuePalmerPruner
+from data import parse_sentences
+
+
+class SRLLabeler(object):
+    """
+    Label the frame elements of batches of (sentence, frame targets),
+    with the vocabulary, the model and the parser loaded once
+
+    The candidates of all the targets of a batch are encoded into one matrix and scored by one matrix product.
+    `n_sentences` and `elapsed` accumulate over the `label` calls, see `throughput`.
+
+    >>> from features import ALL_FEATURES
+    >>> from parser_backend import PreparsedBackend
+    >>> templates = [('phrase_type',), ('frame',)]
+    >>> vocabulary = Vocabulary.build({('phrase_type',): {(u'NP',): 0, (u'ADVP',): 1}, ('frame',): {(u'Giving',): 2}}, templates)
+    >>> model = MaxEntClassifier() # NPs are Donor, ADVPs are Value
+    >>> model.coef = np.array([[3., 0., 0.], [0., 0., 3.], [0., 1., 0.]])
+    >>> model.intercept = np.zeros(3)
+    >>> labeler = SRLLabeler(vocabulary, model, LabelIndex(['Donor', 'NULL', 'Value']), ALL_FEATURES, parser = PreparsedBackend('test_data/parses.tsv'))
+    >>> sent = u'Your contribution to Goodwill will mean more than you may know .'
+    >>> labels = labeler.label([(sent, [Frame(35, 38, 'Giving')])])
+    >>> for (start, end), role, p in labels[0][0]:
+    ...     print '%s | %s | %.2f' %(sent[start:end + 1], role, p)
+    Your contribution | Donor | 0.84
+    Goodwill | Donor | 0.84
+    Your contribution to Goodwill | Donor | 0.84
+    more | Value | 0.84
+    you | Donor | 0.84
+    more than you may know | Value | 0.84
+    >>> labeler.n_sentences
+    1
+
+    With the features hashed(see `feature_encoding.hash_encode`), there is no vocabulary
+
+    >>> model = MaxEntClassifier()
+    >>> model.coef = np.zeros((64, 3))
+    >>> model.coef[hash_column(('phrase_type',), (u'NP',), 64), 0] = 3.
+    >>> model.intercept = np.array([0., 1., 0.])
+    >>> labeler = SRLLabeler(None, model, LabelIndex(['Donor', 'NULL', 'Value']), ALL_FEATURES, parser = PreparsedBackend('test_data/parses.tsv'),
+    ...                      templates = templates, n_hash_features = 64)
+    >>> [role for _, role, _ in labeler.label([(sent, [Frame(35, 38, 'Giving')])])[0][0]]
+    ['Donor', 'Donor', 'Donor', 'Donor']
+    """
+    def __init__(self, vocabulary, model, label_index, feature_funcs, parser = None, parse_cache = None, pruner = None,
+                 templates = None, n_hash_features = None):
+        """
+        vocabulary: `vocabulary.Vocabulary` the model was trained with, its templates are applied.
+                    None if the features were hashed
+        model: trained `maxent.MaxEntClassifier`
+        label_index: `labels.LabelIndex` of the model classes
+        feature_funcs: the features the data was extracted with
+        parser, parse_cache: see `data.parse_sentences`
+        pruner: candidate pruner the data was extracted with, if any(see `candidate_pruning`)
+        templates: the templates, if there is no vocabulary
+        n_hash_features: number of columns the features were hashed into, if they were
+        """
+        if (vocabulary is None) == (n_hash_features is None):
+            raise ValueError("Either a vocabulary or the number of hashed features is needed")
+        self.vocabulary = vocabulary
+        self.templates = vocabulary.templates if vocabulary is not None else templates
+        self.n_hash_features = n_hash_features
+        self.model = model
+        self.label_index = label_index
+        self.extractor = FeatureExtractor(feature_funcs)
+        self.parser = parser
+        self.parse_cache = parse_cache
+        self.pruner = pruner
+
+        self.n_sentences = 0
+        self.elapsed = 0.
+
+    @classmethod
+    def load(cls, model_path, dump_dir = 'dump', **kwargs):
+        """
+        Load the model at `model_path` and the vocabulary and labels written by `data.phase_two_data` under `dump_dir`
+
+        The data is labelled the way the dataset was built(see its meta): with the same templates,
+        by hashing the features if they were hashed(the vocabulary is not used then) and pruning the candidates if they were pruned
+        """
+        from features import ALL_FEATURES
+        dataset = Dataset(os.path.join(dump_dir, 'dataset'))
+        templates = [tuple(str(key) for key in t) for t in dataset.meta['templates']]
+        n_hash_features = dataset.meta.get('n_hash_features')
+        if n_hash_features is None:
+            vocabulary = Vocabulary.load(os.path.join(dump_dir, 'vocabulary'), templates)
+        else:
+            vocabulary = None
+        model = MaxEntClassifier.load(model_path)
+        if model.coef.shape[0] != dataset.n_features:
+            raise ValueError("The model has %d features, the dataset %d" %(model.coef.shape[0], dataset.n_features))
+        if 'pruner' not in kwargs and dataset.meta.get('prune'):
+            kwargs['pruner'] = XuePalmerPruner()
+        return cls(vocabulary, model, dataset.labels,
+                   kwargs.pop('feature_funcs', ALL_FEATURES),
+                   templates = templates, n_hash_features = n_hash_features, **kwargs)
+
+    @property
+    def throughput(self):
+        """
+        Sentences labelled per second
+        """
+        return self.n_sentences / self.elapsed if self.elapsed > 0 else 0.
+
+    def label(self, batch):
+        """
+        batch: list of (sentence, list of `basic_struct.Frame`), target positions are character offsets in the sentence
+
+        Return: for each sentence, for each target, the list of (`NodePosition`, role, probability)
+        of the candidates not labelled NULL. Positions are character offsets in the tokenized sentence(' '.join(tree.leaves()))
+        """
+        start_time = time.time()
+        trees = parse_sentences([sent for sent, _ in batch], self.parser, self.parse_cache)
+
+        rows = []
+        candidates = [] # (sentence number, target number, node position) of each row
+        results = []
+        for i, ((sent, frames), tree) in enumerate(zip(batch, trees)):
+            tree = convert_brackets(tree)
+            tokenized = ' '.join(tree.leaves())
+            targets = align_annotation_with_sentence(sent, tokenized,
+                                                     [Annotation(None, None, f.name, Target(f.start, f.end), []) for f in frames])
+            index = SpanIndex(tree)
+            memo = {}
+            results.append([[] for _ in frames])
+            for j, target in enumerate(targets):
+                frame = Frame(target.target.start, target.target.end, target.frame_name)
+                frame_node = find_node_by_positions(tree, frame.start, frame.end, index)
+                if frame_node is None:
+                    continue
+                nodes = collect_nodes(tree, index)
+                if self.pruner is not None:
+                    nodes = self.pruner.prune(nodes, frame_node, index)
+                for node, (node_start, node_end) in nodes:
+                    node_pos = NodePosition(node_start, node_end)
+                    rows.append(self.extractor.extract(node, Context(tokenized, tree, frame, node_pos, index, memo)))
+                    candidates.append((i, j, node_pos))
+
+        if len(rows) > 0:
+            if self.n_hash_features is not None:
+                x, _ = hash_encode(iter_templates(rows, self.templates), self.n_hash_features)
+            else:
+                x, _ = encode(iter_templates(rows, self.templates), self.vocabulary)
+            proba = self.model.predict_proba(x)
+            predicted = proba.argmax(axis = 1)
+            null_id = self.label_index.null_id
+            for (i, j, node_pos), label_id, p in zip(candidates, predicted, proba[np.arange(len(predicted)), predicted]):
+                if label_id != null_id:
+                    results[i][j].append((node_pos, self.label_index.names[label_id], p))
+
+        self.n_sentences += len(batch)
+        self.elapsed += time.time() - start_time
+        return results
+
+
+if __name__ == "__main__":
+    import sys
+    import codecs
+    import argparse
+    from annotation import parse_fulltext
+
+    parser = argparse.ArgumentParser("Label the frame elements of the targets of FrameNet fulltext files and report the throughput")
+    parser.add_argument("model", help = "Model(.npz) trained by maxent.py")
+    parser.add_argument("paths", nargs = "+", help = "FrameNet fulltext xml files, their targets are labelled")
+    parser.add_argument("-d", type=str, dest = "dump_dir", default = "dump",
+                        help = "Directory of the vocabulary and dataset written by data.py")
+    parser.add_argument("-b", type=int, dest = "batch_size", default = 100,
+                        help = "Number of sentences per batch")
+
+    args = parser.parse_args()
+    labeler = SRLLabeler.load(args.model, args.dump_dir)
+    out = codecs.getwriter('utf8')(sys.stdout)
+
+    batch = []
+    def flush():
+        for (sent, frames), labels in zip(batch, labeler.label(batch)):
+            for frame, frame_labels in zip(frames, labels):
+                for (start, end), role, p in frame_labels:
+                    out.write(u"%s\t%s\t%d\t%d\t%s\t%.3f\n" %(sent, frame.name, start, end, role, p))
+        del batch[:]
+
+    for path in args.paths:
+        for sent, anns in parse_fulltext(path):
+            batch.append((sent, [Frame(ann.target.start, ann.target.end, ann.frame_name) for ann in anns]))
+            if len(batch) >= args.batch_size:
+                flush()
+    flush()
+    sys.stderr.write("%d sentences in %.2fs, %.1f sentences/s\n" %(labeler.n_sentences, labeler.elapsed, labeler.throughput))
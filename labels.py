@@ -0,0 +1,113 @@
+"""
+Integer encoding of the role labels and subsampling of the NULL instances
+"""
+import json
+
+import numpy as np
+
+NULL_LABEL = 'NULL'
+
+
+class LabelIndex(object):
+    """
+    Label name <-> integer id, ids in the order of `names`
+
+    >>> index = LabelIndex.fit(['Agent', 'NULL', 'Theme', 'NULL'])
+    >>> index.names
+    ['Agent', 'NULL', 'Theme']
+    >>> index.encode(['NULL', 'Theme'])
+    array([1, 2], dtype=int32)
+    >>> index.decode([2, 0])
+    ['Theme', 'Agent']
+    >>> index.null_id
+    1
+    >>> index.encode(['Goal'])
+    Traceback (most recent call last):
+    ...
+    KeyError: 'Goal'
+    """
+    def __init__(self, names):
+        self.names = list(names)
+        self.ids = dict((name, i) for i, name in enumerate(self.names))
+
+    @classmethod
+    def fit(cls, labels):
+        return cls(sorted(set(labels)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __eq__(self, other):
+        return isinstance(other, LabelIndex) and self.names == other.names
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def null_id(self):
+        return self.ids.get(NULL_LABEL)
+
+    def encode(self, labels):
+        """
+        int32 array of the label ids
+        """
+        return np.array([self.ids[label] for label in labels], dtype = np.int32)
+
+    def decode(self, ids):
+        return [self.names[i] for i in ids]
+
+    def save(self, path):
+        """
+        >>> import os, tempfile
+        >>> path = tempfile.mktemp()
+        >>> LabelIndex([u'Agent', u'NULL']).save(path)
+        >>> LabelIndex.load(path) == LabelIndex(['Agent', 'NULL'])
+        True
+        >>> os.remove(path)
+        """
+        with open(path, 'w') as f:
+            json.dump({'labels': self.names}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)['labels'])
+
+
+def check_null_rate(rate):
+    """
+    Raise ValueError if `rate` is not a NULL subsampling rate, i.e. not in (0, 1]
+    """
+    if not 0 < rate <= 1:
+        raise ValueError("The NULL rate should be in (0, 1], got %r" % rate)
+
+def subsample_null(labels, rate, seed = 0, null_label = NULL_LABEL):
+    """
+    Keep each `null_label` instance with probability `rate`(0 < `rate` <= 1) and every other instance.
+    The same `labels`, `rate` and `seed` always keep the same instances.
+
+    Return:
+    1. int array of the indices of the kept instances
+    2. float32 array of their weights: 1 / `rate` for the kept NULL instances, 1 for the others,
+       so that the weighted NULL count is an unbiased estimate of the original one
+
+    >>> labels = ['NULL'] * 1000 + ['Agent'] * 10
+    >>> keep, weights = subsample_null(labels, 0.1, seed = 1)
+    >>> len(keep) < 200, (keep[-10:] == np.arange(1000, 1010)).all()
+    (True, True)
+    >>> set(weights[:-10]), set(weights[-10:])
+    (set([10.0]), set([1.0]))
+    >>> (subsample_null(labels, 0.1, seed = 1)[0] == keep).all()
+    True
+    >>> subsample_null(labels, 0)
+    Traceback (most recent call last):
+    ...
+    ValueError: The NULL rate should be in (0, 1], got 0
+    """
+    check_null_rate(rate)
+    rng = np.random.RandomState(seed)
+    is_null = np.array([label == null_label for label in labels], dtype = bool)
+    keep = ~is_null | (rng.random_sample(len(is_null)) < rate)
+    weights = np.where(is_null, 1. / rate, 1.).astype(np.float32)
+    keep = np.flatnonzero(keep)
+    return keep, weights[keep]
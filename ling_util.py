@@ -90,6 +90,56 @@ def get_head_word(node):
             else:
                 return get_head_word(node[-1])
 
+# `rules` as label -> (whether to search from the left, set of head child labels or None for "**")
+compiled_rules = {label: (direction == 'left', None if values == '**' else frozenset(values))
+                  for label, (direction, values) in rules.items()}
+
+def get_head_words(tree):
+    """
+    The head words of all the nodes in `tree`, keyed by id(node)
+
+    Same as calling `get_head_word` on every node, but the heads are percolated bottom-up in one pass
+
+    >>> from nltk.tree import Tree
+    >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('NP', [Tree('PRP$', ['Your']), Tree('NN', ['contribution'])]), Tree('PP', [Tree('TO', ['to']), Tree('NP', [Tree('NNP', ['Goodwill'])])])]), Tree('VP', [Tree('MD', ['will']), Tree('VP', [Tree('VB', ['mean']), Tree('ADVP', [Tree('ADVP', [Tree('RBR', ['more'])]), Tree('SBAR', [Tree('IN', ['than']), Tree('S', [Tree('NP', [Tree('PRP', ['you'])]), Tree('VP', [Tree('MD', ['may']), Tree('VP', [Tree('VB', ['know'])])])])])])])]), Tree('.', ['.'])])])
+    >>> heads = get_head_words(tree)
+    >>> heads[id(tree[0][0][1][1][0])], heads[id(tree[0][0][0])], heads[id(tree[0][1][1])], heads[id(tree[0])]
+    ('Goodwill', 'contribution', 'mean', 'will')
+    >>> print heads[id(tree)] # no rule for ROOT
+    None
+    """
+    heads = {}
+    stack = [(tree, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if not isinstance(node, Tree):
+            continue
+        if not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node)
+            continue
+
+        if len(node) == 1 and isinstance(node[0], basestring):
+            heads[id(node)] = node[0]
+            continue
+
+        label = node.label()
+        last = node[-1]
+        if label.startswith('N') and isinstance(last, Tree) and last.label().startswith('N'):
+            heads[id(node)] = heads.get(id(last))
+        elif label in compiled_rules:
+            from_left, label_values = compiled_rules[label]
+            head_child = node[0] if from_left else last
+            if label_values is not None:
+                for child in (node if from_left else reversed(node)):
+                    if isinstance(child, Tree) and child.label() in label_values:
+                        head_child = child
+                        break
+            heads[id(node)] = heads.get(id(head_child))
+        else:
+            heads[id(node)] = None
+    return heads
+
 
 
 mapping = dict(zip('-LRB- -RRB- -RSB- -RSB- -LCB- -RCB-'.split(), '( ) [ ] { }'.split()))
@@ -0,0 +1,313 @@
+"""
+Multinomial maximum entropy(logistic regression) classifier over the encoded CSR data
+"""
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.optimize import fmin_l_bfgs_b
+
+from file_util import write_atomic
+
+
+def _loss_grad(coef, intercept, x, y, weights):
+    """
+    Weighted negative log likelihood of labels `y` of rows `x` and its gradient w.r.t. `coef` and `intercept`
+    """
+    scores = x.dot(coef) + intercept
+    scores -= scores.max(axis = 1)[:, None]
+    log_proba = scores - np.log(np.exp(scores).sum(axis = 1))[:, None]
+
+    rows = np.arange(x.shape[0])
+    loss = -np.dot(weights, log_proba[rows, y])
+
+    # d loss / d scores = weights * (P - Y)
+    residual = np.exp(log_proba)
+    residual[rows, y] -= 1
+    residual *= weights[:, None]
+    return loss, x.T.dot(residual), residual.sum(axis = 0)
+
+# the chunks of the data, set before the pool is forked so the workers share them
+_chunks = None
+
+def _chunk_loss_grad(args):
+    i, coef, intercept = args
+    x, y, weights = _chunks[i]
+    return _loss_grad(coef, intercept, x, y, weights)
+
+
+def _save_atomic(path, **arrays):
+    """
+    np.savez to a temporary file renamed to `path`, so that a crash never leaves a partial file
+    """
+    write_atomic(path, lambda f: np.savez(f, **arrays))
+
+
+class MaxEntClassifier(object):
+    """
+    Trained by L-BFGS on the L2-regularized weighted negative log likelihood
+
+    l2: strength of the L2 regularization of the coefficients(not of the intercepts)
+    max_iter: maximum number of L-BFGS iterations
+    n_jobs: number of processes computing the loss and gradient, each over a chunk of the rows
+    verbose: write the loss and wall-clock time of each iteration to stderr
+
+    After `fit`, `iteration_times` holds the wall-clock seconds of each iteration.
+    `fit_stream` trains out of core on mini-batches instead.
+
+    >>> rng = np.random.RandomState(0)
+    >>> x = csr_matrix((rng.random_sample((300, 20)) < 0.2).astype(np.int32))
+    >>> y = np.asarray(x[:, :3].argmax(axis = 1)).ravel() # the label is the first of the first 3 features set
+    >>> clf = MaxEntClassifier(l2 = 0.1).fit(x, y)
+    >>> (clf.predict(x) == y).mean() > 0.95
+    True
+    >>> np.allclose(clf.predict_proba(x).sum(axis = 1), 1)
+    True
+    >>> len(clf.iteration_times) > 0
+    True
+    >>> clf2 = MaxEntClassifier(l2 = 0.1, n_jobs = 2).fit(x, y)
+    >>> np.allclose(clf2.coef, clf.coef, atol = 1e-4)
+    True
+
+    The gradient is the one of the loss
+
+    >>> from scipy.optimize import check_grad
+    >>> weights = rng.random_sample(300)
+    >>> f = lambda params: clf._objective(params, [(x.astype(np.float64), y, weights)], 4, None)[0]
+    >>> g = lambda params: clf._objective(params, [(x.astype(np.float64), y, weights)], 4, None)[1]
+    >>> check_grad(f, g, rng.randn(21 * 4)) < 1e-4
+    True
+    """
+    def __init__(self, l2 = 1.0, max_iter = 100, n_jobs = 1, verbose = False):
+        self.l2 = l2
+        self.max_iter = max_iter
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.coef = None
+        self.intercept = None
+        self.iteration_times = []
+
+    @property
+    def n_classes(self):
+        return len(self.intercept)
+
+    def _unpack(self, params, n_classes):
+        coef = params[:-n_classes].reshape(-1, n_classes)
+        return coef, params[-n_classes:]
+
+    def _objective(self, params, chunks, n_classes, pool):
+        coef, intercept = self._unpack(params, n_classes)
+        if pool is None:
+            results = [_loss_grad(coef, intercept, x, y, weights) for x, y, weights in chunks]
+        else:
+            results = pool.map(_chunk_loss_grad, [(i, coef, intercept) for i in xrange(len(chunks))])
+
+        loss = sum(r[0] for r in results) + 0.5 * self.l2 * (coef ** 2).sum()
+        coef_grad = sum(r[1] for r in results) + self.l2 * coef
+        intercept_grad = sum(r[2] for r in results)
+        return loss, np.concatenate([coef_grad.ravel(), intercept_grad])
+
+    def fit(self, x, y, sample_weight = None, n_classes = None):
+        """
+        x: scipy.sparse matrix, e.g. from `feature_encoding.encode`
+        y: integer label ids, e.g. from `labels.LabelIndex.encode`
+        sample_weight: instance weights, e.g. from `labels.subsample_null`
+        n_classes: number of labels, max(y) + 1 if not given
+        """
+        global _chunks
+        x = csr_matrix(x, dtype = np.float64)
+        y = np.asarray(y, dtype = np.int32)
+        weights = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype = np.float64)
+        if n_classes is None:
+            n_classes = y.max() + 1
+
+        bounds = np.linspace(0, x.shape[0], max(self.n_jobs, 1) + 1).astype(int)
+        chunks = [(x[s:e], y[s:e], weights[s:e]) for s, e in zip(bounds[:-1], bounds[1:])]
+        pool = None
+        if self.n_jobs > 1:
+            _chunks = chunks
+            pool = Pool(self.n_jobs)
+
+        self.iteration_times = []
+        last = [time.time()]
+        last_loss = [None]
+        def objective(params):
+            loss, grad = self._objective(params, chunks, n_classes, pool)
+            last_loss[0] = loss
+            return loss, grad
+
+        def callback(params):
+            # the last objective evaluated is the one of the new `params`, it is not computed again
+            now = time.time()
+            self.iteration_times.append(now - last[0])
+            last[0] = now
+            if self.verbose:
+                sys.stderr.write("Iteration %d: loss %.4f, %.3fs\n" %(len(self.iteration_times), last_loss[0], self.iteration_times[-1]))
+
+        try:
+            params, loss, info = fmin_l_bfgs_b(objective, np.zeros((x.shape[1] + 1) * n_classes),
+                                               maxiter = self.max_iter, callback = callback)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+                _chunks = None
+
+        if info['warnflag'] != 0:
+            sys.stderr.write("Warning: L-BFGS did not converge: %s\n" % info['task'])
+        self.coef, self.intercept = self._unpack(params, n_classes)
+        return self
+
+    def fit_stream(self, batches, n_features, n_classes, n_rows, n_epochs = 5, learning_rate = 0.1,
+                   checkpoint = None):
+        """
+        Train by AdaGrad over mini-batches, so that the data never has to fit in memory
+
+        batches: function of the epoch number returning an iterable of (x, label ids, weights) mini-batches,
+                 e.g. `lambda epoch: dataset.iter_batches(1000, shuffle = True, seed = epoch)`(see `dataset.Dataset`)
+        n_rows: number of rows per epoch, the L2 penalty is spread over the batches in proportion to their size
+        checkpoint: path of a .npz the model and the AdaGrad state are saved to after each epoch.
+                    If it exists, training resumes from it.
+
+        Only the coefficients of the features present in a batch are updated(and regularized) by it.
+
+        >>> import os, tempfile
+        >>> from dataset import (write_dataset, Dataset)
+        >>> rng = np.random.RandomState(0)
+        >>> x = csr_matrix((rng.random_sample((300, 20)) < 0.2).astype(np.int32))
+        >>> y = np.asarray(x[:, :3].argmax(axis = 1)).ravel()
+        >>> path = tempfile.mkdtemp()
+        >>> write_dataset(path, x, y, shard_size = 100)
+        >>> dataset = Dataset(path)
+        >>> batches = lambda epoch: dataset.iter_batches(20, shuffle = True, seed = epoch)
+        >>> checkpoint = os.path.join(path, 'checkpoint.npz')
+        >>> clf = MaxEntClassifier(l2 = 0.1).fit_stream(batches, 20, 3, len(dataset), n_epochs = 10, learning_rate = 0.5)
+        >>> (clf.predict(x) == y).mean() > 0.95
+        True
+
+        Training stopped after 4 epochs and resumed from its checkpoint ends the same
+
+        >>> _ = MaxEntClassifier(l2 = 0.1).fit_stream(batches, 20, 3, len(dataset), n_epochs = 4, learning_rate = 0.5, checkpoint = checkpoint)
+        >>> clf2 = MaxEntClassifier(l2 = 0.1).fit_stream(batches, 20, 3, len(dataset), n_epochs = 10, learning_rate = 0.5, checkpoint = checkpoint)
+        >>> len(clf2.iteration_times), np.allclose(clf2.coef, clf.coef)
+        (6, True)
+        >>> import shutil; shutil.rmtree(path)
+        """
+        coef = np.zeros((n_features, n_classes))
+        intercept = np.zeros(n_classes)
+        # AdaGrad sums of the squared gradients
+        coef_g2 = np.zeros_like(coef)
+        intercept_g2 = np.zeros_like(intercept)
+        first_epoch = 0
+        if checkpoint is not None and os.path.exists(checkpoint):
+            f = np.load(checkpoint)
+            coef, intercept, coef_g2, intercept_g2 = f['coef'], f['intercept'], f['coef_g2'], f['intercept_g2']
+            first_epoch = int(f['epoch']) + 1
+
+        eps = 1e-8
+        self.iteration_times = []
+        for epoch in xrange(first_epoch, n_epochs):
+            start = time.time()
+            loss = 0.
+            for x, y, weights in batches(epoch):
+                # restrict the batch to the features present in it
+                columns, local_indices = np.unique(x.indices, return_inverse = True)
+                x = csr_matrix((np.asarray(x.data, dtype = np.float64), local_indices, x.indptr),
+                               shape = (x.shape[0], len(columns)))
+                y = np.asarray(y, dtype = np.int32)
+                weights = np.asarray(weights, dtype = np.float64)
+
+                batch_coef = coef[columns]
+                batch_loss, coef_grad, intercept_grad = _loss_grad(batch_coef, intercept, x, y, weights)
+                share = float(x.shape[0]) / n_rows
+                loss += batch_loss + share * 0.5 * self.l2 * (batch_coef ** 2).sum()
+                coef_grad += share * self.l2 * batch_coef
+
+                coef_g2[columns] += coef_grad ** 2
+                coef[columns] -= learning_rate * coef_grad / (np.sqrt(coef_g2[columns]) + eps)
+                intercept_g2 += intercept_grad ** 2
+                intercept -= learning_rate * intercept_grad / (np.sqrt(intercept_g2) + eps)
+
+            self.iteration_times.append(time.time() - start)
+            if self.verbose:
+                sys.stderr.write("Epoch %d: loss %.4f, %.3fs\n" %(epoch, loss, self.iteration_times[-1]))
+            if checkpoint is not None:
+                _save_atomic(checkpoint, coef = coef, intercept = intercept,
+                             coef_g2 = coef_g2, intercept_g2 = intercept_g2, epoch = epoch)
+
+        self.coef, self.intercept = coef, intercept
+        return self
+
+    def decision_function(self, x):
+        return x.dot(self.coef) + self.intercept
+
+    def predict_proba(self, x):
+        scores = self.decision_function(x)
+        scores -= scores.max(axis = 1)[:, None]
+        proba = np.exp(scores)
+        proba /= proba.sum(axis = 1)[:, None]
+        return proba
+
+    def predict(self, x):
+        return self.decision_function(x).argmax(axis = 1)
+
+    def save(self, path):
+        """
+        >>> import os, tempfile
+        >>> clf = MaxEntClassifier()
+        >>> clf.coef, clf.intercept = np.arange(6.).reshape(3, 2), np.zeros(2)
+        >>> path = tempfile.mktemp(suffix = '.npz')
+        >>> clf.save(path)
+        >>> (MaxEntClassifier.load(path).coef == clf.coef).all()
+        True
+        >>> os.remove(path)
+        """
+        np.savez(path, coef = self.coef, intercept = self.intercept, l2 = self.l2)
+
+    @classmethod
+    def load(cls, path):
+        f = np.load(path)
+        clf = cls(l2 = float(f['l2']))
+        clf.coef, clf.intercept = f['coef'], f['intercept']
+        return clf
+
+
+if __name__ == "__main__":
+    import argparse
+    from dataset import Dataset
+
+    parser = argparse.ArgumentParser("Train a maximum entropy classifier on a dataset written by data.phase_two_data")
+    parser.add_argument("dataset", help = "Dataset directory")
+    parser.add_argument("model", help = "Path of the model(.npz) to save")
+    parser.add_argument("--l2", type=float, default = 1.0,
+                        help = "Strength of the L2 regularization")
+    parser.add_argument("--max-iter", type=int, dest = "max_iter", default = 100,
+                        help = "Maximum number of L-BFGS iterations")
+    parser.add_argument("-j", type=int, dest = "n_jobs", default = 1,
+                        help = "Number of processes computing the gradient")
+    parser.add_argument("--stream", action = "store_true",
+                        help = "Train by AdaGrad over mini-batches read from the dataset shards, without loading the dataset")
+    parser.add_argument("--epochs", type=int, default = 5,
+                        help = "With --stream, number of passes over the data")
+    parser.add_argument("--batch-size", type=int, dest = "batch_size", default = 1000,
+                        help = "With --stream, number of rows per mini-batch")
+    parser.add_argument("--learning-rate", type=float, dest = "learning_rate", default = 0.1,
+                        help = "With --stream, AdaGrad learning rate")
+    parser.add_argument("--checkpoint", type=str,
+                        help = "With --stream, save the training state there after each epoch and resume from it")
+
+    args = parser.parse_args()
+    dataset = Dataset(args.dataset)
+    clf = MaxEntClassifier(args.l2, args.max_iter, args.n_jobs, verbose = True)
+    if args.stream:
+        batches = lambda epoch: dataset.iter_batches(args.batch_size, shuffle = True, seed = epoch)
+        clf.fit_stream(batches, dataset.n_features, len(dataset.labels), len(dataset),
+                       args.epochs, args.learning_rate, args.checkpoint)
+    else:
+        x, y, weights = dataset.load()
+        clf.fit(x, y, weights, n_classes = len(dataset.labels))
+    sys.stderr.write("%d iterations, %.3fs per iteration\n" %(len(clf.iteration_times), np.mean(clf.iteration_times)))
+    clf.save(args.model)
@@ -0,0 +1,146 @@
+"""
+On-disk cache of constituency parses
+
+Entries are addressed by the content of the sentence(whitespace-normalized) together with the parser model id,
+so the same sentence parsed by the same model is never parsed twice, no matter which file or run it comes from.
+"""
+import os
+import hashlib
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from file_util import pickle_atomic
+
+
+def normalize_sentence(sent):
+    """
+    >>> normalize_sentence(u'  Your  contribution\\tto Goodwill ')
+    u'Your contribution to Goodwill'
+    """
+    return u' '.join(sent.split())
+
+def sentence_key(sent, model_id):
+    """
+    The cache key of `sent` parsed by model `model_id`
+
+    >>> sentence_key(u'I love you', 'englishPCFG') == sentence_key(u'I  love you ', 'englishPCFG')
+    True
+    >>> sentence_key(u'I love you', 'englishPCFG') == sentence_key(u'I love you', 'englishFactored')
+    False
+    """
+    sent = normalize_sentence(sent)
+    if isinstance(sent, unicode):
+        sent = sent.encode('utf8')
+    if isinstance(model_id, unicode):
+        model_id = model_id.encode('utf8')
+    return hashlib.sha1(model_id + '\0' + sent).hexdigest()
+
+
+class ParseCache(object):
+    """
+    Content-addressed parse tree cache under `cache_dir`
+
+    At most `max_entries` trees are kept(unbounded if None). When the limit is exceeded,
+    the least recently used entries are evicted until `low_water` of the limit remains.
+
+    >>> import shutil
+    >>> from nltk.tree import Tree
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> cache = ParseCache(cache_dir, 'englishPCFG', max_entries = 2)
+    >>> print cache.get(u'I love you')
+    None
+    >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])])])
+    >>> cache.put(u'I love you', tree)
+    >>> cache.get(u'I love  you') == tree
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> print ParseCache(cache_dir, 'englishFactored').get(u'I love you')
+    None
+    >>> cache.put(u'You love me', tree)
+    >>> cache.put(u'Me love you', tree)
+    >>> len(cache) <= 2
+    True
+    >>> len(ParseCache(cache_dir, 'englishPCFG')) == len(cache)
+    True
+    >>> shutil.rmtree(cache_dir)
+    """
+    def __init__(self, cache_dir, model_id, max_entries = None, low_water = 0.9):
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.low_water = low_water
+
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._n_entries = len(self._entry_paths())
+
+    def __len__(self):
+        return self._n_entries
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total > 0 else 0.
+
+    def _path(self, sent):
+        key = sentence_key(sent, self.model_id)
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def _entry_paths(self):
+        paths = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            paths += [os.path.join(dirpath, name)
+                      for name in filenames if name.endswith('.pkl')]
+        return paths
+
+    def get(self, sent):
+        """
+        Return the cached tree of `sent` or None if it's not cached
+        """
+        path = self._path(sent)
+        try:
+            with open(path, 'rb') as f:
+                tree = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        os.utime(path, None) # mark as recently used
+        self.hits += 1
+        return tree
+
+    def put(self, sent, tree):
+        path = self._path(sent)
+        d = os.path.dirname(path)
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+        is_new = not os.path.exists(path)
+
+        # write to a temporary file first so that readers never see a partial entry
+        pickle_atomic(tree, path)
+
+        if is_new:
+            self._n_entries += 1
+            if self.max_entries is not None and self._n_entries > self.max_entries:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is below its low water mark
+        """
+        target = int(self.max_entries * self.low_water)
+        paths = sorted(self._entry_paths(), key = os.path.getmtime)
+        for path in paths[:max(0, len(paths) - target)]:
+            try:
+                os.remove(path)
+            except OSError: # removed by another process
+                pass
+        self._n_entries = len(self._entry_paths())
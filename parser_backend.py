@@ -0,0 +1,123 @@
+"""
+Constituency parser backends
+
+A backend turns a batch of raw sentence strings into parse trees(`nltk.tree.Tree`), in the same order.
+"""
+import os
+import sys
+import codecs
+
+from nltk.tree import Tree
+
+from parse_cache import normalize_sentence
+
+
+class ParserBackend(object):
+    """
+    `model_id` identifies the parses the backend produces(used as part of the parse cache key)
+    """
+    model_id = None
+
+    def parse_sents(self, sents):
+        """
+        sents: list of sentence strings
+
+        Return: list of parse trees, one per sentence
+        """
+        raise NotImplementedError
+
+
+class StanfordParserBackend(ParserBackend):
+    """
+    Stanford parser, which is started lazily on the first `parse_sents` call
+
+    Sentences are sent to the parser in batches of `batch_size`, so one JVM is launched per batch instead of per sentence
+
+    >>> backend = StanfordParserBackend('/no/such/stanford-parser.jar', '/no/such/stanford-parser-3.5.1-models.jar', 'edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz')
+    >>> backend.model_id
+    'stanford-parser-3.5.1-models.jar:edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz'
+    >>> print backend._parser
+    None
+    """
+    def __init__(self, path_to_jar, path_to_models_jar, model_path, batch_size = 500):
+        self.path_to_jar = path_to_jar
+        self.path_to_models_jar = path_to_models_jar
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.model_id = os.path.basename(path_to_models_jar) + ':' + model_path
+        self._parser = None
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            from nltk.parse.stanford import StanfordParser
+            self._parser = StanfordParser(
+                path_to_jar = self.path_to_jar,
+                path_to_models_jar = self.path_to_models_jar,
+                model_path = self.model_path
+            )
+        return self._parser
+
+    def parse_sents(self, sents):
+        trees = []
+        for i in xrange(0, len(sents), self.batch_size):
+            for parses in self.parser.raw_parse_sents(sents[i:i+self.batch_size]):
+                trees.append(parses.next())
+        assert len(trees) == len(sents), "%d trees for %d sentences" %(len(trees), len(sents))
+        return trees
+
+
+class PreparsedBackend(ParserBackend):
+    """
+    Serve parses stored on disk(see `write_preparsed`), so the pipeline can run without Java
+
+    The file contains one `sentence<TAB>bracketed tree` per line
+
+    >>> backend = PreparsedBackend('test_data/parses.tsv')
+    >>> backend.model_id
+    'preparsed:parses.tsv'
+    >>> backend.parse_sents([u'Your contribution to Goodwill will mean more than you may know .'])[0][0][0]
+    Tree('NP', [Tree('NP', [Tree('PRP$', ['Your']), Tree('NN', ['contribution'])]), Tree('PP', [Tree('TO', ['to']), Tree('NP', [Tree('NNP', ['Goodwill'])])])])
+    >>> backend.parse_sents([u'Not parsed before .']) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    KeyError: u"No parse for 'Not parsed before .' in test_data/parses.tsv"
+    """
+    def __init__(self, path):
+        self.path = path
+        self.model_id = 'preparsed:' + os.path.basename(path)
+        self.parses = {}
+        with codecs.open(path, 'r', 'utf8') as f:
+            for l in f:
+                if len(l.strip()) == 0:
+                    continue
+                sent, tree_str = l.rstrip('\n').split('\t')
+                self.parses[normalize_sentence(sent)] = tree_str
+
+    def parse_sents(self, sents):
+        trees = []
+        for sent in sents:
+            try:
+                tree_str = self.parses[normalize_sentence(sent)]
+            except KeyError:
+                raise KeyError(u"No parse for '%s' in %s" %(sent, self.path))
+            trees.append(Tree.fromstring(tree_str))
+        return trees
+
+
+def write_preparsed(path, sents, trees):
+    """
+    Write the parses in the format read by `PreparsedBackend`
+
+    >>> import os, tempfile
+    >>> from nltk.tree import Tree
+    >>> path = tempfile.mktemp()
+    >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])])])
+    >>> write_preparsed(path, [u'I love you'], [tree])
+    >>> PreparsedBackend(path).parse_sents([u'I love you']) == [tree]
+    True
+    >>> os.remove(path)
+    """
+    with codecs.open(path, 'a', 'utf8') as f:
+        for sent, tree in zip(sents, trees):
+            f.write(u'%s\t%s\n' %(normalize_sentence(sent), tree.pformat(margin = sys.maxint)))
@@ -10,3 +10,13 @@ python -m doctest data.py
 python -m doctest features.py
 python -m doctest ling_util.py
 python -m doctest dependency_path.py
+python -m doctest parse_cache.py
+python -m doctest parser_backend.py
+python -m doctest vocabulary.py
+python -m doctest dataset.py
+python -m doctest labels.py
+python -m doctest candidate_pruning.py
+python -m doctest maxent.py
+python -m doctest labeler.py
+python -m doctest dependency_cache.py
+python -m doctest file_util.py
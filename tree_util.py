@@ -1,11 +1,120 @@
 from nltk.tree import Tree
 
-def collect_nodes(tree):
+class SpanIndex(object):
+    """
+    Spans of all the nodes of a parse tree, computed in one pass over the tree
+
+    Character positions are relative to the text string(' '.join(tree.leaves())) and inclusive,
+    word positions are leaf indices with exclusive end. As in `collect_nodes`, the root is excluded.
+
+    Attributes:
+    - leaf_offsets: character start of each leaf
+    - leaf_positions: tree position of each leaf
+    - nodes: (node, (start, end)) of the nodes in post-order
+    - node_spans: id(node) -> character (start, end)
+    - word_spans: id(node) -> word (start, end)
+    - by_span: character (start, end) -> the highest node having that span
+    - node_at: tree position -> node(the root included)
+    - parents: id(node) -> parent node
+
+    >>> from nltk.tree import Tree
+    >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])])])
+    >>> index = SpanIndex(tree)
+    >>> index.leaf_offsets
+    [0, 2, 7]
+    >>> index.leaf_positions
+    [(0, 0, 0, 0), (0, 1, 0, 0), (0, 1, 1, 0, 0)]
+    >>> index.by_span[(7, 9)]
+    Tree('NP', [Tree('PRP', ['you'])])
+    >>> index.word_spans[id(tree[0][1])]
+    (1, 3)
+    >>> index.word_range(2, 9)
+    (1, 3)
+    >>> print index.word_range(3, 9)
+    None
+    >>> index.treeposition_spanning_words(1, 3)
+    (0, 1)
+    >>> index.treeposition_spanning_words(2, 3) == tree.treeposition_spanning_leaves(2, 3)
+    True
+    >>> index.node_at[(0, 1, 1)]
+    Tree('NP', [Tree('PRP', ['you'])])
+    >>> index.parents[id(tree[0][1][1])] is tree[0][1]
+    True
+    """
+    def __init__(self, tree):
+        assert isinstance(tree, Tree)
+        assert len(tree) == 1
+        self.tree = tree
+        self.leaf_offsets = []
+        self.leaf_positions = []
+        self.nodes = []
+        self.node_spans = {}
+        self.word_spans = {}
+        self.by_span = {}
+        self.node_at = {(): tree, (0, ): tree[0]}
+        self.parents = {id(tree[0]): tree}
+
+        # (subtree, position, char start, word start, index of the next child to visit)
+        stack = [[tree[0], (0, ), 0, 0, 0]]
+        offset = 0 # character offset of the next leaf
+        while stack:
+            top = stack[-1]
+            subtree, position, start, word_start, i = top
+            if i < len(subtree):
+                top[4] += 1
+                child = subtree[i]
+                if isinstance(child, Tree):
+                    child_position = position + (i, )
+                    self.node_at[child_position] = child
+                    self.parents[id(child)] = subtree
+                    stack.append([child, child_position, offset, len(self.leaf_offsets), 0])
+                else: # a string
+                    self.leaf_offsets.append(offset)
+                    self.leaf_positions.append(position + (i, ))
+                    offset += len(child) + 1 # one space
+            else:
+                stack.pop()
+                span = (start, offset - 2)
+                self.nodes.append((subtree, span))
+                self.node_spans[id(subtree)] = span
+                self.word_spans[id(subtree)] = (word_start, len(self.leaf_offsets))
+                self.by_span[span] = subtree # post-order, so the ancestors override
+
+        self._word_starts = {o: i for i, o in enumerate(self.leaf_offsets)}
+        self._word_ends = {o + len(leaf) - 1: i + 1
+                           for i, (o, leaf) in enumerate(zip(self.leaf_offsets, tree.leaves()))}
+
+    def word_range(self, char_start, char_end):
+        """
+        The word (start, end) of the character range, None if the range does not align with word boundaries
+        """
+        start = self._word_starts.get(char_start)
+        end = self._word_ends.get(char_end)
+        if start is None or end is None or start >= end:
+            return None
+        return start, end
+
+    def treeposition_spanning_words(self, start, end):
+        """
+        Same as `tree.treeposition_spanning_leaves(start, end)`, without scanning the leaves
+        """
+        if end <= start:
+            raise ValueError('end must be greater than start')
+        start_pos = self.leaf_positions[start]
+        end_pos = self.leaf_positions[end - 1]
+        for i in xrange(len(start_pos)):
+            if i == len(end_pos) or start_pos[i] != end_pos[i]:
+                return start_pos[:i]
+        return start_pos
+
+def collect_nodes(tree, index = None):
     """
     Collect all the nodes as well as thei char position ranges from the tree
 
     The root is ecluded
 
+    `index` is the `SpanIndex` of the tree, built if not given
+
     >>> from nltk.tree import Tree
     >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])])])
     >>> node_info = collect_nodes(tree)
@@ -29,28 +138,18 @@ def collect_nodes(tree):
     >>> node_info
     [(Tree('PRP', ['I']), (0, 0)), (Tree('NP', [Tree('PRP', ['I'])]), (0, 0)), (Tree('VBP', ['love']), (2, 5)), (Tree('PRP', ['you']), (7, 9)), (Tree('NP', [Tree('PRP', ['you'])]), (7, 9)), (Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])]), (2, 9)), (Tree('S', [Tree('NP', [Tree('PRP', ['I'])]), Tree('VP', [Tree('VBP', ['love']), Tree('NP', [Tree('PRP', ['you'])])])]), (0, 9))]
     """
-    assert isinstance(tree, Tree)
-    def aux(subtree, acc, start):
-        if isinstance(subtree, Tree):
-            start_offset = start
-            for i in xrange(len(subtree)):
-                if isinstance(subtree[i], Tree):
-                    length = len(' '.join(subtree[i].leaves()))
-                else: # a string
-                    length = len(subtree[i])
-                aux(subtree[i], acc, start_offset)
-                start_offset += (length+1) # one space
-            acc.append((subtree, (start, start_offset-2)))
-    nodes = []
-    assert len(tree) == 1
-    aux(tree[0], nodes, 0)
-    return nodes
-
-def find_node_by_positions(tree, start, end):
+    if index is None:
+        index = SpanIndex(tree)
+    return list(index.nodes) # a copy, the callers may filter it
+
+def find_node_by_positions(tree, start, end, index = None):
     """
     Given the start/end(inclusive) index of the text string(' '.join(tree.leaves())), find the corresponding node in the tree
 
-    Time complexity: O(height of the tree)
+    If several nodes have that span, the highest one is returned.
+
+    `index` is the `SpanIndex` of the tree, built if not given.
+    Time complexity: O(1) given the index
     
     >>> from nltk.tree import Tree
     >>> tree = Tree('ROOT', [Tree('S', [Tree('NP', [Tree('NP', [Tree('PRP$', ['Your']), Tree('NN', ['contribution'])]), Tree('PP', [Tree('TO', ['to']), Tree('NP', [Tree('NNP', ['Goodwill'])])])]), Tree('VP', [Tree('MD', ['will']), Tree('VP', [Tree('VB', ['mean']), Tree('ADVP', [Tree('ADVP', [Tree('RBR', ['more'])]), Tree('SBAR', [Tree('IN', ['than']), Tree('S', [Tree('NP', [Tree('PRP', ['you'])]), Tree('VP', [Tree('MD', ['may']), Tree('VP', [Tree('VB', ['know'])])])])])])])]), Tree('.', ['.'])])])
@@ -68,29 +167,6 @@ def find_node_by_positions(tree, start, end):
     """
     assert start >= 0 and start <= end, "Invalid range %r" %((start, end), )
 
-    # Binary search for the target range
-    tree = tree[0]# we don't consider the root
-    offset = 0
-    tree_word_length = lambda t: len(' '.join(t.leaves()))
-    
-    while True:
-        if offset == start and start + tree_word_length(tree) - 1 == end:
-            return tree
-        else:
-            found_range = False
-            subtree_start = offset
-            for subtree in tree:
-                subtree_end = subtree_start + tree_word_length(subtree) - 1
-                if start >= subtree_start and end <= subtree_end:
-                    found_range = True
-                    offset = subtree_start
-                    tree = subtree
-                    break
-                else:
-                    subtree_start = subtree_end + 2
-                    tree = subtree
-            if not found_range:
-                # the target range lies in the intersection between the two subtrees
-                return None
-
-    
+    if index is None:
+        index = SpanIndex(tree)
+    return index.by_span.get((start, end))
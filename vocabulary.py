@@ -0,0 +1,221 @@
+"""
+Vocabulary of the encoded features: templated feature value -> matrix column
+
+Saved as a directory, so that it loads without unpickling and can be memory-mapped
+and shared read-only between processes:
+
+- meta.json: format version, the templates and the number of columns
+- per template i, the values as JSON strings sorted bytewise, concatenated in `i.keys`,
+  with their boundaries in `i.offsets.npy` and their columns in `i.columns.npy`
+"""
+import os
+import json
+import mmap
+
+import numpy as np
+
+VERSION = 1
+
+
+def value_key(value):
+    """
+    The string a templated feature value is stored as, the same for str and unicode
+
+    >>> value_key((u'NP', 'u', 1))
+    '["NP","u",1]'
+    >>> value_key(('NP',)) == value_key([u'NP'])
+    True
+    """
+    return json.dumps(value, separators = (',', ':'))
+
+
+def _as_tuples(value):
+    """
+    The value decoded from JSON, with lists back to tuples
+    """
+    if isinstance(value, list):
+        return tuple(_as_tuples(v) for v in value)
+    return value
+
+
+class TemplateVocabulary(object):
+    """
+    The values of one template, looked up by binary search over the sorted keys
+    """
+    # lookups are memoized, values repeat a lot
+    cache_size = 100000
+
+    def __init__(self, keys, offsets, columns):
+        self.keys = keys
+        self.offsets = offsets
+        self.columns = columns
+        self._found = {}
+
+    def __len__(self):
+        return len(self.columns)
+
+    def _key(self, i):
+        return self.keys[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def get(self, value, default = None):
+        try:
+            column = self._found[value]
+        except KeyError:
+            if len(self._found) >= self.cache_size:
+                self._found.clear()
+            column = self._found[value] = self._search(value_key(value))
+        except TypeError: # unhashable
+            column = self._search(value_key(value))
+        return default if column is None else column
+
+    def _search(self, key):
+        lo, hi = 0, len(self.columns)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.columns) and self._key(lo) == key:
+            return int(self.columns[lo])
+        return None
+
+    def __getitem__(self, value):
+        column = self.get(value)
+        if column is None:
+            raise KeyError(value)
+        return column
+
+    def __contains__(self, value):
+        return self.get(value) is not None
+
+    def items(self):
+        """
+        (value, column) pairs in key order, strings in the values are unicode
+        """
+        for i in xrange(len(self.columns)):
+            yield _as_tuples(json.loads(self._key(i))), int(self.columns[i])
+
+
+class Vocabulary(object):
+    """
+    Mapping-like view(template -> `TemplateVocabulary`) usable as the mapping of `feature_encoding.encode`
+
+    >>> import shutil, tempfile
+    >>> templates = [('a',), ('a', 'b')]
+    >>> mapping = {('a',): {(1,): 0, (2,): 1}, ('a', 'b'): {(1, u'x'): 2}}
+    >>> path = tempfile.mkdtemp()
+    >>> Vocabulary.build(mapping, templates).save(path)
+    >>> vocab = Vocabulary.load(path, templates)
+    >>> vocab.n_features, len(vocab), vocab[('a',)][(2,)], vocab[('a', 'b')].get((1, 'x'))
+    (3, 2, 1, 2)
+    >>> print vocab[('a', 'b')].get((2, 'x'))
+    None
+    >>> vocab.to_mapping() == mapping
+    True
+    >>> Vocabulary.load(path, [('a',)])
+    Traceback (most recent call last):
+    ...
+    ValueError: Vocabulary built with templates [('a',), ('a', 'b')], not [('a',)]
+
+    Encoding new data with the saved columns, in worker processes too
+
+    >>> from feature_encoding import encode
+    >>> rows = [{('a',): (2,), ('a', 'b'): (2, 'x')}, {('a',): (1,), ('a', 'b'): (1, 'x')}]
+    >>> x, _ = encode(rows, vocab)
+    >>> x.toarray()
+    array([[0, 1, 0],
+           [1, 0, 1]], dtype=int32)
+    >>> (encode(rows, vocab, n_jobs = 2, shard_size = 1)[0] != x).nnz
+    0
+    >>> shutil.rmtree(path)
+    """
+    def __init__(self, templates, tables, n_features, path = None):
+        self.templates = [tuple(t) for t in templates]
+        self.tables = dict(zip(self.templates, tables))
+        self.n_features = n_features
+        self.path = path
+
+    @classmethod
+    def build(cls, mapping, templates):
+        """
+        mapping: template -> templated value -> column, as returned by `feature_encoding.encode`
+        """
+        tables = []
+        n_features = 0
+        for template in templates:
+            pairs = sorted((value_key(value), column) for value, column in mapping.get(template, {}).items())
+            offsets = np.zeros(len(pairs) + 1, dtype = np.int64)
+            np.cumsum([len(key) for key, _ in pairs], out = offsets[1:])
+            columns = np.array([column for _, column in pairs], dtype = np.int32)
+            tables.append(TemplateVocabulary(''.join(key for key, _ in pairs), offsets, columns))
+            if len(columns) > 0:
+                n_features = max(n_features, columns.max() + 1)
+        return cls(templates, tables, int(n_features))
+
+    def save(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for i, template in enumerate(self.templates):
+            table = self.tables[template]
+            with open(os.path.join(path, '%d.keys' % i), 'wb') as f:
+                f.write(table.keys[:])
+            np.save(os.path.join(path, '%d.offsets.npy' % i), table.offsets)
+            np.save(os.path.join(path, '%d.columns.npy' % i), table.columns)
+        # written last, a directory without it is incomplete
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'version': VERSION,
+                       'templates': self.templates,
+                       'n_features': self.n_features}, f)
+
+    @classmethod
+    def load(cls, path, templates = None):
+        """
+        Memory-map the vocabulary saved under `path`
+
+        templates: if given, must be the templates the vocabulary was built with
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != VERSION:
+            raise ValueError("Vocabulary version %d, expected %d" %(meta['version'], VERSION))
+        saved_templates = [tuple(str(key) for key in t) for t in meta['templates']]
+        if templates is not None and [tuple(t) for t in templates] != saved_templates:
+            raise ValueError("Vocabulary built with templates %r, not %r" %(saved_templates, list(templates)))
+
+        tables = []
+        for i in xrange(len(saved_templates)):
+            with open(os.path.join(path, '%d.keys' % i), 'rb') as f:
+                if os.fstat(f.fileno()).st_size > 0:
+                    keys = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+                else: # empty files can't be mapped
+                    keys = ''
+            tables.append(TemplateVocabulary(keys,
+                                             np.load(os.path.join(path, '%d.offsets.npy' % i), mmap_mode = 'r'),
+                                             np.load(os.path.join(path, '%d.columns.npy' % i), mmap_mode = 'r')))
+        return cls(saved_templates, tables, meta['n_features'], path)
+
+    def __reduce__(self):
+        # a saved vocabulary is sent to other processes by path, to be mapped again there
+        if self.path is not None:
+            return (Vocabulary.load, (self.path, self.templates))
+        return object.__reduce__(self)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def __getitem__(self, template):
+        return self.tables[template]
+
+    def get(self, template, default = None):
+        return self.tables.get(template, default)
+
+    def to_mapping(self):
+        """
+        The vocabulary as nested dicts, like the mapping of `feature_encoding.encode`
+        """
+        return {template: {value: column for value, column in self.tables[template].items()}
+                for template in self.templates}